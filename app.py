@@ -1,10 +1,11 @@
 from flask import (
     Flask,
+    abort,
     redirect,
     render_template,
     request,
     flash,
-    send_from_directory,
+    send_file,
     url_for,
 )
 from flask_login import (
@@ -15,7 +16,6 @@ from flask_login import (
     login_required,
 )
 from models import (
-    BuyHistoryModel,
     db,
     UserLoginModel,
     UserInfoModel,
@@ -26,8 +26,56 @@ from models import (
     BookIssueModel,
     BookFeedbackModel,
 )
+import click
 import os
+from auth import get_current_user_info
+from authors import get_book_authors
+from blobstore import (
+    blob_path,
+    claim_blob,
+    collect_garbage,
+    content_version,
+    is_blob,
+    migrate_legacy_books,
+    release_blob,
+    store_stream,
+)
+from benchmarks import search_benchmark, sqlite_benchmark
 from blueprints.api import api_bp, login_manager
+from book_feedback import save_feedback, valid_rating
+from circulation import (
+    Decision,
+    request_book,
+    request_messages,
+    request_status,
+    review_failures,
+    review_requests,
+    review_summary,
+)
+from book_import import default_batch_size, default_workers, import_books
+from db_profile import configure_sqlite
+from expiry import issue_not_expired, start_issue_sweeper, sweep_expired_issues
+from export import export_catalogue, export_formats, export_models, pyarrow
+from migrations import upgrade_database
+from page_text import (
+    create_page_index,
+    index_missing_pages,
+    schedule_page_extraction,
+    search_pages,
+)
+from pagination import id_page, page_args, page_links
+from passwords import LoginBusy, benchmark_kdf, benchmark_methods, hash_password, verify_password
+from previews import ensure_preview, previews_enabled
+from purchases import create_purchase_summaries, rebuild_purchase_summaries, record_purchase
+from ratings import create_rating_index, get_book_rating, rating_json, rebuild_ratings
+from search import (
+    create_search_index,
+    rebuild_search_index,
+    search_books,
+    search_books_page,
+)
+from stats import get_dashboard_stats
+from uploads import UploadError, finish_upload, remove_stale_uploads
 from datetime import datetime, timedelta, date
 from typing import List, Callable
 from werkzeug.utils import secure_filename
@@ -35,11 +83,25 @@ from werkzeug.utils import secure_filename
 currentDirectory = os.path.dirname(os.path.realpath(__file__))
 
 app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = (
-    f'sqlite:///{os.path.join(currentDirectory, "db.sqlite3")}'
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+    "DATABASE_URL", f'sqlite:///{os.path.join(currentDirectory, "db.sqlite3")}'
 )
 app.config["SECRET_KEY"] = "PsIK>@%=`TiDs$>"
-
+app.config["DASHBOARD_STATS_TTL"] = 10
+app.config["SQLITE_PROFILE"] = "wal"
+app.config["ISSUE_SWEEP_INTERVAL"] = 60 * 60
+app.config["MAX_BOOK_SIZE"] = 512 * 1024 * 1024
+app.config["UPLOAD_EXPIRY"] = 24 * 60 * 60
+app.config["PREVIEW_WIDTH"] = 240
+app.config["PREVIEW_CACHE_SIZE"] = 64 * 1024 * 1024
+app.config["TEXT_EXTRACT_WORKERS"] = 2
+app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:600000"
+app.config["PASSWORD_HASH_WORKERS"] = os.cpu_count()
+app.config["PASSWORD_HASH_QUEUE"] = 16
+app.config["PASSWORD_HASH_TIMEOUT"] = 5
+app.config["LOGIN_CACHE_TTL"] = 60
+
+configure_sqlite(app)
 db.init_app(app)
 
 app.app_context().push()
@@ -47,21 +109,27 @@ app.app_context().push()
 login_manager.init_app(app)
 app.register_blueprint(api_bp)
 
+upgrade_database()
+create_search_index()
+create_page_index()
+create_rating_index()
+create_purchase_summaries()
+
 UPLOAD_FOLDER: str = "/static/books"
 cwd = os.getcwd()
 app.config["UPLOAD_FOLDER"] = os.getcwd() + UPLOAD_FOLDER
 
 allowed_extensions = {"pdf"}
 
-login_manager = LoginManager()
-
 max_issue_time = 7
 
+book_cache_max_age = 365 * 24 * 60 * 60
+
 # Decorator function to verify role
 def check_role(role: str):
     def decorator(function: Callable):
         def wrapper(*args, **kwargs):
-            info = UserInfoModel.query.filter_by(uid=current_user.id).first()
+            info = get_current_user_info()
 
             if not info:
                 return "Info not found", 404
@@ -76,154 +144,43 @@ def check_role(role: str):
 
     return decorator
 
-def raw(input: str) -> str:
-    return input.lower().replace(" ", "")
-
-
-def isFileAllowed(filename: str):
-    return ("." in filename) and (filename.split(".")[-1].lower() in allowed_extensions)
-
-
-def findBooks(search_word: str, filter_section=None):
-    modified_search_word = "%" + raw(search_word) + "%"
-    all_hits = []
-
-    if filter_section:
-        book_hits = (
-            BookModel.query.filter(BookModel.search_word.like(modified_search_word))
-            .filter_by(section_id=filter_section)
-            .all()
-        )
-
-        author_hits = (
-            BookAuthorModel.query.filter(
-                BookAuthorModel.search_word.like(modified_search_word)
-            )
-            .join(BookModel, onclause=BookAuthorModel.book_id == BookModel.id)
-            .filter_by(section_id=filter_section)
-            .with_entities(
-                BookModel.id,
-                BookModel.isbn,
-                BookModel.name,
-                BookModel.content,
-                BookModel.page_count,
-                BookModel.publisher,
-                BookModel.volume,
-                BookModel.section_id,
-                BookModel.search_word,
-            )
-            .all()
-        )
-
-        section_hits = (
-            SectionModel.query.filter(
-                SectionModel.search_word.like(modified_search_word)
-            )
-            .join(BookModel, onclause=SectionModel.id == BookModel.section_id)
-            .filter_by(section_id=filter_section)
-            .with_entities(
-                BookModel.id,
-                BookModel.isbn,
-                BookModel.name,
-                BookModel.content,
-                BookModel.page_count,
-                BookModel.publisher,
-                BookModel.volume,
-                BookModel.section_id,
-                BookModel.search_word,
-            )
-            .all()
-        )
-
-    else:
-        book_hits = (
-            BookModel.query.filter(BookModel.search_word.like(modified_search_word))
-            .join(SectionModel, onclause=SectionModel.id == BookModel.section_id)
-            .with_entities(
-                BookModel.id,
-                BookModel.isbn,
-                BookModel.name,
-                BookModel.content,
-                BookModel.page_count,
-                BookModel.publisher,
-                BookModel.volume,
-                BookModel.section_id,
-                BookModel.search_word,
-                SectionModel.name.label("section_name"),
-            )
-            .all()
-        )
-
-        author_hits = (
-            BookAuthorModel.query.filter(
-                BookAuthorModel.search_word.like(modified_search_word)
-            )
-            .join(BookModel, onclause=BookAuthorModel.book_id == BookModel.id)
-            .join(SectionModel, onclause=SectionModel.id == BookModel.section_id)
-            .with_entities(
-                BookModel.id,
-                BookModel.isbn,
-                BookModel.name,
-                BookModel.content,
-                BookModel.page_count,
-                BookModel.publisher,
-                BookModel.volume,
-                BookModel.section_id,
-                BookModel.search_word,
-                SectionModel.name.label("section_name"),
-            )
-            .all()
-        )
-
-        section_hits = (
-            SectionModel.query.filter(
-                SectionModel.search_word.like(modified_search_word)
-            )
-            .join(BookModel, onclause=SectionModel.id == BookModel.section_id)
-            .with_entities(
-                BookModel.id,
-                BookModel.isbn,
-                BookModel.name,
-                BookModel.content,
-                BookModel.page_count,
-                BookModel.publisher,
-                BookModel.volume,
-                BookModel.section_id,
-                BookModel.search_word,
-                SectionModel.name.label("section_name"),
-            )
-            .all()
+def send_book(book, as_attachment=False, max_age=None):
+    """Send a book PDF with ETag, If-None-Match and Range (206) handling, or 404 if it is missing."""
+    try:
+        response = send_file(
+            blob_path(book.content),
+            mimetype="application/pdf",
+            as_attachment=as_attachment,
+            download_name=secure_filename(book.name) + ".pdf",
+            conditional=True,
+            etag=book.content if is_blob(book.content) else True,
+            max_age=max_age,
         )
+    except OSError:
+        abort(404)
+    # Books are only readable by the users they are issued to
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
 
-    if book_hits:
-        for book in book_hits:
-            # For unique books
-            if book.id in [book_hit.id for book_hit in all_hits]:
-                continue
-            all_hits.append(book)
-
-    if author_hits:
-        for book in author_hits:
-            if book.id in [book_hit.id for book_hit in all_hits]:
-                continue
-            all_hits.append(book)
-
-    if section_hits:
-        for book in section_hits:
-            if book.id in [book_hit.id for book_hit in all_hits]:
-                continue
-            all_hits.append(book)
 
-    return all_hits
+@app.template_global()
+def preview_url(book):
+    """URL of book's first page thumbnail, or None when previews are off or its PDF is missing."""
+    if not previews_enabled():
+        return None
+    # Blobs stay in the store while a book refers to them; legacy files may be gone
+    if not is_blob(book.content) and not os.path.exists(blob_path(book.content)):
+        return None
+    return url_for("bookPreview", id=book.id, v=content_version(book.content))
 
 
-def get_all_book_authors():
-    return BookAuthorModel.query.all()
+def raw(input: str) -> str:
+    return input.lower().replace(" ", "")
 
 
-@login_manager.user_loader
-def load_user(id):
-    return UserLoginModel.query.get(id)
+def isFileAllowed(filename: str):
+    return ("." in filename) and (filename.split(".")[-1].lower() in allowed_extensions)
 
 
 @app.route("/", methods=["GET"])
@@ -235,7 +192,7 @@ def home():
 def librarianLogin():
     if request.method == "GET":
         if current_user.is_authenticated:
-            user_info = UserInfoModel.query.filter_by(uid=current_user.id).first()
+            user_info = get_current_user_info()
             if user_info and user_info.role == "Librarian":
                 return redirect("/librarianDashboard")
 
@@ -255,7 +212,13 @@ def librarianLogin():
         flash(f"There is no info regarding user {username}")
         return redirect(request.url)
 
-    if userLogin and userLogin.password == password:
+    try:
+        password_matches = verify_password(userLogin, password)
+    except LoginBusy:
+        flash("Too many logins at once, please try again in a moment")
+        return redirect(request.url)
+
+    if password_matches:
         if userInfo and userInfo.role != role:
             flash(f"Incorrect Username or Password")
             return redirect(request.url)
@@ -272,7 +235,7 @@ def librarianLogin():
 def generalLogin():
     if request.method == "GET":
         if current_user.is_authenticated:
-            user_info = UserInfoModel.query.filter_by(uid=current_user.id).first()
+            user_info = get_current_user_info()
             if user_info and user_info.role == "General":
                 return redirect("/generalDashboard")
         return render_template("login.html", role="general")
@@ -291,7 +254,13 @@ def generalLogin():
         flash(f"There is no info regarding user {username}")
         return redirect("/generalLogin")
 
-    if userLogin and userLogin.password == password:
+    try:
+        password_matches = verify_password(userLogin, password)
+    except LoginBusy:
+        flash("Too many logins at once, please try again in a moment")
+        return redirect("/generalLogin")
+
+    if password_matches:
         if userInfo and userInfo.role != role:
             flash(f"Incorrect Username or Password")
             return redirect("/generalLogin")
@@ -326,7 +295,17 @@ def addUser():
         flash("Username already exists")
         return redirect(request.url)
 
-    userLogin = UserLoginModel(username=username, password=password)  # type: ignore
+    if not password:
+        flash("Password not provided")
+        return redirect(request.url)
+
+    try:
+        password_hash = hash_password(password)
+    except LoginBusy:
+        flash("Too many sign ups at once, please try again in a moment")
+        return redirect(request.url)
+
+    userLogin = UserLoginModel(username=username, password=password_hash)  # type: ignore
     db.session.add(userLogin)
     db.session.commit()
     userInfo = UserInfoModel(uid=userLogin.id, first_name=first_name, last_name=last_name, role=role)  # type: ignore
@@ -344,39 +323,10 @@ def viewAllBooks():
 @login_required
 @check_role(role="Librarian")
 def librarianDashboard():
-    section_count = 0
-    sections = SectionModel.query.all()
-    if sections:
-        section_count = len(list(sections))
-
-    book_count = 0
-    books = BookModel.query.all()
-    if books:
-        book_count = len(list(books))
-
-    request_count = 0
-    requests = BookRequestsModel.query.all()
-    if requests:
-        request_count = len(list(requests))
-
-    issue_count = 0
-    issues = BookIssueModel.query.all()
-    if issues:
-        issue_count = len(list(issues))
-
-    general_count = 0
-    general_users = UserInfoModel.query.filter_by(role="General").all()
-    if general_users:
-        general_count = len(list(general_users))
-
     return render_template(
         "librarianDashboard.html",
         role="Librarian",
-        section_count=section_count,
-        book_count = book_count,
-        request_count=request_count,
-        issue_count=issue_count,
-        general_count=general_count,
+        **get_dashboard_stats(),
     )
 
 
@@ -385,7 +335,7 @@ def librarianDashboard():
 @check_role(role="Librarian")
 def sections():
     sections = SectionModel.query.all()
-    user_info = UserInfoModel.query.filter_by(uid=current_user.id).first()
+    user_info = get_current_user_info()
     if not user_info:
         flash("User info does not exist")
         return redirect(url_for("librarianDashboard"))
@@ -443,44 +393,28 @@ def addBook():
     isbn = request.form.get("isbn")
     book_name = request.form.get("book_name")
     page_count = request.form.get("page_count")
-    book_file = request.files["book_file"]
+    book_file = request.files.get("book_file")
+    upload_id = request.form.get("upload_id")
     publisher = request.form.get("publisher")
     volume = request.form.get("volume")
     author_names = request.form.get("author_names")
     price = request.form.get("price")
 
-    
-
-    if not book_file:
-        flash("Book file not given")
-        return redirect(f"/librarianDashboard/addBook?section_id={section_id}")
-
-    if not book_file.filename:
-        flash("No file name")
-        return redirect(f"/librarianDashboard/addBook?section_id={section_id}")
-
-    filename = secure_filename(book_file.filename)
+    if not upload_id:
+        if not book_file:
+            flash("Book file not given")
+            return redirect(f"/librarianDashboard/addBook?section_id={section_id}")
 
-    if not isFileAllowed(filename):
-        flash("This file type is not allowed")
-        return redirect(f"/librarianDashboard/addBook?section_id={section_id}")
+        if not book_file.filename:
+            flash("No file name")
+            return redirect(f"/librarianDashboard/addBook?section_id={section_id}")
 
-    content_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+        filename = secure_filename(book_file.filename)
 
-    if os.path.exists(content_path):
-        book = BookModel.query.filter_by(content="books/" + filename).first()
-        if not book:
-            flash(
-                "There is a book pdf which exists but there is no book with the corresponding path.\
-                     Need to manually remove the pdf"
-            )
+        if not isFileAllowed(filename):
+            flash("This file type is not allowed")
             return redirect(f"/librarianDashboard/addBook?section_id={section_id}")
 
-        flash(
-            f"This book PDF already exists and is referenced by book_id: {book.id} with name: {book.name}"
-        )
-        return redirect(f"/librarianDashboard/addBook?section_id={section_id}")
-
     try:
         if page_count:
             page_count = int(page_count)
@@ -542,26 +476,38 @@ def addBook():
         + raw(str(page_count))
     )
 
-    book = BookModel(
-        isbn=isbn,
-        name=book_name,
-        page_count=page_count,
-        content="books/" + filename,
-        publisher=publisher,
-        volume=volume,
-        section_id=section.id,
-        search_word=search_word,
-        price=price,
-    )  # type: ignore
-    db.session.add(book)
-    db.session.commit()
+    # Identical PDFs share one stored copy
+    try:
+        if upload_id:
+            content = finish_upload(upload_id)
+        else:
+            content = store_stream(book_file.stream)
+    except UploadError as e:
+        flash(str(e))
+        return redirect(f"/librarianDashboard/addBook?section_id={section_id}")
 
-    for author_name in author_names_list:
-        author_search_word: str = raw(author_name)
-        author = BookAuthorModel(book_id=book.id, author_name=author_name, search_word=author_search_word)  # type: ignore
-        db.session.add(author)
-    db.session.commit()
-    book_file.save(content_path)
+    with claim_blob(content):
+        book = BookModel(
+            isbn=isbn,
+            name=book_name,
+            page_count=page_count,
+            content=content,
+            publisher=publisher,
+            volume=volume,
+            section_id=section.id,
+            search_word=search_word,
+            price=price,
+        )  # type: ignore
+        db.session.add(book)
+        db.session.flush()
+
+        for author_name in author_names_list:
+            author_search_word: str = raw(author_name)
+            author = BookAuthorModel(book_id=book.id, author_name=author_name, search_word=author_search_word)  # type: ignore
+            db.session.add(author)
+        db.session.commit()
+    ensure_preview(content)
+    schedule_page_extraction(content)
 
     return redirect(f"/sections/{section.id}")
 
@@ -571,8 +517,6 @@ def addBook():
 @login_required
 def viewBooks(section_id):
 
-    book_authors = get_all_book_authors()
-
     section = SectionModel.query.filter_by(id=section_id).first()
 
     if not section:
@@ -580,15 +524,20 @@ def viewBooks(section_id):
         return redirect(url_for("sections"))
 
     books = BookModel.query.filter_by(section_id=section.id).all()
+    book_authors = get_book_authors(book.id for book in books)
 
-    user_info = UserInfoModel.query.filter_by(uid=current_user.id).first()
+    user_info = get_current_user_info()
     if not user_info:
         flash("User info does not exist")
         return redirect("/")
 
     print(books)
 
-    book_issues = BookIssueModel.query.filter_by(uid=current_user.id).all()
+    book_issues = (
+        BookIssueModel.query.filter_by(uid=current_user.id)
+        .filter(issue_not_expired())
+        .all()
+    )
     book_requests = BookRequestsModel.query.filter_by(uid=current_user.id).all()
 
     my_books = []
@@ -613,7 +562,7 @@ def viewBooks(section_id):
 @check_role(role="General")
 def generalDashboard():
 
-    user_info = UserInfoModel.query.filter_by(uid=current_user.id).first()
+    user_info = get_current_user_info()
     if not user_info:
         flash("User info does not exist")
         return redirect("/")
@@ -621,6 +570,7 @@ def generalDashboard():
     book_issues = (
         BookIssueModel.query
         .filter_by(uid=current_user.id)
+        .filter(issue_not_expired())
         .join(
             BookModel, onclause=BookIssueModel.book_id == BookModel.id
         )
@@ -651,24 +601,38 @@ def generalDashboard():
 @login_required
 def requestBooks():
 
-    book_authors = get_all_book_authors()
-
     book_requests = BookRequestsModel.query.filter_by(uid=current_user.id).all()
-    book_issues = BookIssueModel.query.filter_by(uid=current_user.id).all()
+    book_issues = (
+        BookIssueModel.query.filter_by(uid=current_user.id)
+        .filter(issue_not_expired())
+        .all()
+    )
 
     issued_book_ids = [book_request.book_id for book_request in book_requests]
     issued_book_ids.extend([book_issue.book_id for book_issue in book_issues])
     print(issued_book_ids)
-    books = (
-        db.session.query(BookModel, SectionModel)
-        .join(SectionModel, onclause=SectionModel.id == BookModel.section_id)
-        .all()
+
+    limit, after, before = page_args()
+    page = id_page(
+        db.session.query(BookModel, SectionModel).join(
+            SectionModel, onclause=SectionModel.id == BookModel.section_id
+        ),
+        BookModel.id,
+        after=after,
+        before=before,
+        limit=limit,
+        cursor_of=lambda row: row[0].id,
     )
+    prev_url, next_url = page_links(page)
+    book_authors = get_book_authors(book.id for book, section in page.items)
+
     return render_template(
         "allBooks.html",
-        books=books,
+        books=page.items,
         issued_book_ids=issued_book_ids,
         book_authors=book_authors,
+        prev_url=prev_url,
+        next_url=next_url,
     )
 
 
@@ -685,24 +649,9 @@ def requestBook():
             flash("Book does not exist")
             return redirect(url_for("requestBooks"))
 
-        request_book = BookRequestsModel.query.filter_by(
-            book_id=id, uid=current_user.id
-        ).first()
-        if request_book:
-            flash("Book request already exists")
-            return redirect("/generalDashboard/requestBooks/")
-
-        issue_book = BookIssueModel.query.filter_by(
-            book_id=id, uid=current_user.id
-        ).first()
-        if issue_book:
-            flash("Book has already been issued")
-            return redirect("/generalDashboard/requestBooks/")
-
-        book_request = BookRequestsModel.query.filter_by(uid=current_user.id).all()
-        book_issue = BookIssueModel.query.filter_by(uid=current_user.id).all()
-        if (len(book_request) + len(book_issue)) >= 5:
-            flash("You can only request/issue 5 books at once")
+        status = request_status(book.id, current_user.id)  # type: ignore
+        if status:
+            flash(request_messages[status])
             return redirect("/generalDashboard/requestBooks/")
 
         return render_template("requestForm.html", id=id)
@@ -724,24 +673,11 @@ def requestBook():
         flash("Book does not exist")
         return redirect(url_for("requestBooks"))
 
-    book_request = BookRequestsModel.query.filter_by(
-        book_id=book.id, uid=current_user.id
-    ).first()
-    if book_request:
-        flash("Book request already exists")
-        return redirect(url_for("requestBooks"))
-
-    book_issue = BookIssueModel.query.filter_by(
-        book_id=book.id, uid=current_user.id
-    ).first()
-    if book_issue:
-        flash("Book has already been issued")
+    status = request_book(book.id, current_user.id, issue_time)  # type: ignore
+    if status in request_messages:
+        flash(request_messages[status])
         return redirect(url_for("requestBooks"))
 
-    book_request = BookRequestsModel(book_id=book.id, uid=current_user.id, date_of_request=date.today(), issue_time=issue_time)  # type: ignore
-    db.session.add(book_request)
-    db.session.commit()
-
     return redirect("/generalDashboard/requestBooks")
 
 
@@ -751,8 +687,6 @@ def requestBook():
 def generalBooks():
     if request.method == "GET":
 
-        book_authors = get_all_book_authors()
-
         requested = (
             db.session.query(BookRequestsModel, BookModel)
             .join(BookRequestsModel, onclause=BookRequestsModel.book_id == BookModel.id)
@@ -763,21 +697,12 @@ def generalBooks():
             db.session.query(BookIssueModel, BookModel)
             .join(BookIssueModel, onclause=BookIssueModel.book_id == BookModel.id)
             .filter_by(uid=current_user.id)
+            .filter(issue_not_expired())
             .all()
         )
 
-        for issued_book, book in issued:
-            if issued_book.date_of_return < date.today():
-                BookIssueModel.query.filter_by(
-                    book_id=issued_book.book_id, uid=current_user.id
-                ).delete()
-
-        db.session.commit()
-        issued = (
-            db.session.query(BookIssueModel, BookModel)
-            .join(BookIssueModel, onclause=BookIssueModel.book_id == BookModel.id)
-            .filter_by(uid=current_user.id)
-            .all()
+        book_authors = get_book_authors(
+            [book.id for _, book in requested] + [book.id for _, book in issued]
         )
 
         return render_template(
@@ -836,11 +761,18 @@ def dealWithRequest():
     if accept == "1":
         # Accept book
 
-        book_issue = BookIssueModel.query.filter_by(book_id=book.id, uid=uid).first()
+        book_issue = (
+            BookIssueModel.query.filter_by(book_id=book.id, uid=uid)
+            .filter(issue_not_expired())
+            .first()
+        )
         if book_issue:
             flash("Book Issue already exists")
             return redirect(url_for("viewRequests"))
 
+        # An expired issue the sweeper hasn't reached yet would block the new one
+        BookIssueModel.query.filter_by(book_id=book.id, uid=uid).delete()
+
         book_issue = BookIssueModel(book_id=book.id, uid=uid, date_of_issue=date.today(), date_of_return=date.today() + timedelta(int(issue_time)))  # type: ignore
 
         BookRequestsModel.query.filter_by(book_id=book.id, uid=uid).delete()
@@ -857,6 +789,43 @@ def dealWithRequest():
         return redirect("/librarianDashboard/viewRequests")
 
 
+@app.route("/librarianDashboard/viewRequests/review/", methods=["POST"])
+@login_required
+@check_role(role="Librarian")
+def reviewRequests():
+    accept = request.form.get("accept")
+    if accept not in ("0", "1"):
+        flash("accept should be in (0,1)")
+        return redirect(url_for("viewRequests"))
+
+    decisions = []
+    for selected in request.form.getlist("request"):
+        try:
+            book_id, uid = selected.split(":")
+            decisions.append(Decision(int(book_id), int(uid), accept == "1"))
+        except ValueError:
+            flash(f"Invalid request {selected}")
+            return redirect(url_for("viewRequests"))
+
+    if not decisions:
+        flash("No requests selected")
+        return redirect(url_for("viewRequests"))
+
+    results = review_requests(decisions)
+    flash(
+        ", ".join(
+            f"{status.replace('_', ' ')}: {count}"
+            for status, count in review_summary(results).items()
+        )
+    )
+    for result in review_failures(results):
+        flash(
+            f"Book {result['book_id']} for user {result['uid']}: {result['status'].replace('_', ' ')}"
+        )
+
+    return redirect(url_for("viewRequests"))
+
+
 @app.route("/returnBook/", methods=["GET"])
 @login_required
 @check_role(role="General")
@@ -893,18 +862,18 @@ def feedback():
 
     id = request.args.get("id")
     feedback = request.form.get("feedback")
-    rating = request.form.get("rating")
+    rating = request.form.get("rating", type=int)
 
     book = BookModel.query.filter_by(id=id).first()
     if not book:
         flash("Book does not exist")
         return redirect(url_for("generalDashboard"))
 
-    BookFeedbackModel.query.filter_by(uid=current_user.id, book_id=book.id).delete()
+    if not valid_rating(rating):
+        flash("Rating should be between 0 and 10")
+        return redirect(url_for("feedback", id=book.id))
 
-    book_feedback = BookFeedbackModel(uid=current_user.id, book_id=book.id, feedback=feedback, rating=rating)  # type: ignore
-    db.session.add(book_feedback)
-    db.session.commit()
+    save_feedback(current_user.id, book.id, feedback, rating)  # type: ignore
 
     return redirect("/generalDashboard/books")
 
@@ -914,7 +883,7 @@ def feedback():
 @check_role(role="General")
 def generalViewSections():
     sections = SectionModel.query.all()
-    user_info = UserInfoModel.query.filter_by(uid=current_user.id).first()
+    user_info = get_current_user_info()
     if not user_info:
         flash("User info does not exist")
         return redirect("/")
@@ -933,6 +902,7 @@ def librarianDashboarRevokeAccess():
             BookModel, onclause=BookIssueModel.book_id == BookModel.id
         )
         .join(UserInfoModel, onclause=UserInfoModel.uid == BookIssueModel.uid)
+        .filter(issue_not_expired())
         .with_entities(
             BookIssueModel.book_id,
             BookModel.name,
@@ -1054,12 +1024,13 @@ def editBook():
     name = request.form.get("name")
     authors = request.form.get("authors")
     page_count = request.form.get("page_count")
-    book_file = request.files["book_file"]
+    book_file = request.files.get("book_file")
+    upload_id = request.form.get("upload_id")
     publisher = request.form.get("publisher")
     volume = request.form.get("volume")
     section_name = request.form.get("section_name")
 
-    content_path = None
+    new_file = False
     if book_file:
         if book_file.filename:
             filename = secure_filename(book_file.filename)
@@ -1068,21 +1039,7 @@ def editBook():
                 flash("This file type is not allowed")
                 return redirect(f"/librarianDashboard/editBook?id={book_id}")
 
-            content_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-
-            if os.path.exists(content_path):
-                book = BookModel.query.filter_by(content="books/" + filename).first()
-                if not book:
-                    flash(
-                        "There is a book pdf which exists but there is no book with the corresponding path.\
-                            Need to manually remove the pdf"
-                    )
-                    return redirect(f"/librarianDashboard/editBook?id={book_id}")
-
-                flash(
-                    f"This book PDF already exists and is referenced by book_id: {book.id} with name: {book.name}"
-                )
-                return redirect(f"/librarianDashboard/editBook?id={book_id}")
+            new_file = True
 
     try:
         if page_count:
@@ -1100,15 +1057,30 @@ def editBook():
         flash("Book does not exist")
         return redirect(f"/librarianDashboard/editBook?id={book_id}")
 
-    if isbn:
-        book.isbn = isbn
-
     if section_name:
         section = SectionModel.query.filter_by(name=section_name).first()
         if not section:
             flash("Section does not exist")
             return redirect(f"/librarianDashboard/editBook?id={book_id}")
-        book.section_id = section.id
+    else:
+        section = SectionModel.query.filter_by(id=book.section_id).first()
+
+    # Stored before the book changes: the store locks the database on its own
+    # connection, which would wait on the session's pending writes
+    new_content = None
+    try:
+        if upload_id:
+            new_content = finish_upload(upload_id)
+        elif new_file:
+            new_content = store_stream(book_file.stream)
+    except UploadError as e:
+        flash(str(e))
+        return redirect(f"/librarianDashboard/editBook?id={book_id}")
+
+    if isbn:
+        book.isbn = isbn
+
+    book.section_id = section.id
 
     if name:
         book.name = name
@@ -1125,17 +1097,6 @@ def editBook():
     if page_count:
         book.page_count = page_count
 
-    if content_path:
-        old_content = book.content
-        try:
-            old_path = os.path.join(app.config["UPLOAD_FOLDER"], old_content[6:])
-            old_path = old_path.replace("\\", "/")
-            os.remove(old_path)
-        except Exception as e:
-            return str(e)
-        book.content = "books/" + filename
-        book_file.save(content_path)
-
     if publisher:
         book.publisher = publisher
 
@@ -1151,7 +1112,15 @@ def editBook():
         + raw(str(book.page_count))
     )
 
-    db.session.commit()
+    old_content = book.content
+    with claim_blob(new_content):
+        if new_content:
+            book.content = new_content
+        db.session.commit()
+    if book.content != old_content:
+        release_blob(old_content)
+        ensure_preview(book.content)
+        schedule_page_extraction(book.content)
 
     return redirect(f"/sections/{section.id}")
 
@@ -1195,11 +1164,6 @@ def removeBook():
     section_id = book.section_id
 
     old_content = book.content
-    try:
-        old_path = os.path.join(app.config["UPLOAD_FOLDER"], old_content[6:])
-        os.remove(old_path)
-    except Exception as e:
-        return str(e)
 
     BookAuthorModel.query.filter_by(book_id=id).delete()
     BookRequestsModel.query.filter_by(book_id=id).delete()
@@ -1208,6 +1172,7 @@ def removeBook():
 
     BookModel.query.filter_by(id=id).delete()
     db.session.commit()
+    release_blob(old_content)
 
     return redirect(f"/sections/{section_id}")
 
@@ -1223,10 +1188,9 @@ def viewBookStatus():
         flash("Book does not exist")
         return redirect(url_for("librarianDashboard"))
 
-    book_issues = BookIssueModel.query.filter_by(book_id=id).all()
-
     book_and_users = (
         BookIssueModel.query.filter_by(book_id=id)
+        .filter(issue_not_expired())
         .join(UserInfoModel, onclause=BookIssueModel.uid == UserInfoModel.uid)
         .with_entities(
             BookIssueModel.book_id,
@@ -1252,18 +1216,81 @@ def readBook():
         flash("Book does not exist")
         return redirect(url_for("sections"))
     
-    user_info = UserInfoModel.query.filter_by(uid = current_user.id).first()
+    user_info = get_current_user_info()
     if not user_info:
         flash("User info not found")
         return redirect("/")
 
     if user_info.role == "General":
-        book_issue = BookIssueModel.query.filter_by(uid = current_user.id, book_id = id).first()
+        book_issue = (
+            BookIssueModel.query.filter_by(uid=current_user.id, book_id=id)
+            .filter(issue_not_expired())
+            .first()
+        )
         if not book_issue:
             flash("You do not have access to this book")
             return redirect(f"/sections/{book.section_id}")
 
-    return render_template("/readBook.html", book=book)
+    if not os.path.exists(blob_path(book.content)):
+        abort(404)
+
+    # Page hits from the content search open at the matching page
+    start_page = max(1, request.args.get("page", default=1, type=int))
+
+    return render_template(
+        "/readBook.html",
+        book=book,
+        content_version=content_version(book.content),
+        start_page=start_page,
+    )
+
+
+@app.route("/readBook/content/", methods=["GET"])
+@login_required
+def readBookContent():
+    id = request.args.get("id")
+    book = BookModel.query.filter_by(id=id).first()
+    if not book:
+        return "Book does not exist", 404
+
+    user_info = get_current_user_info()
+    if not user_info:
+        return "User info not found", 404
+
+    if user_info.role == "General":
+        book_issue = (
+            BookIssueModel.query.filter_by(uid=current_user.id, book_id=id)
+            .filter(issue_not_expired())
+            .first()
+        )
+        if not book_issue:
+            return "You do not have access to this book", 403
+
+    # The URL carries the content version, so the browser can keep it for good
+    return send_book(book, max_age=book_cache_max_age)
+
+
+@app.route("/bookPreview/<int:id>", methods=["GET"])
+@login_required
+def bookPreview(id):
+    book = BookModel.query.filter_by(id=id).first()
+    if not book:
+        return "Book does not exist", 404
+
+    version = content_version(book.content)
+    if request.args.get("v") != version:
+        return redirect(url_for("bookPreview", id=id, v=version))
+
+    path = ensure_preview(book.content)
+    if not path:
+        return "Preview not available", 404
+
+    # A new PDF gets a new version and so a new URL, the old one never changes
+    response = send_file(path, mimetype="image/png", max_age=book_cache_max_age)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
 
 
 @app.route("/readFeedback/", methods=["GET"])
@@ -1271,7 +1298,7 @@ def readBook():
 def readFeedback():
     id = request.args.get("id")
 
-    user_info = UserInfoModel.query.filter_by(uid=current_user.id).first()
+    user_info = get_current_user_info()
     if not user_info:
         flash("User info not found")
         return redirect("/")
@@ -1323,7 +1350,10 @@ def readFeedback():
         )
 
         return render_template(
-            "readSpecificFeedback.html", book_feedbacks=book_feedbacks, role=role
+            "readSpecificFeedback.html",
+            book_feedbacks=book_feedbacks,
+            book_rating=rating_json(get_book_rating(book.id)),
+            role=role,
         )
 
 
@@ -1347,7 +1377,7 @@ def searchSection():
         SectionModel.search_word.like(modified_search_word)
     ).all()
 
-    user_info = UserInfoModel.query.filter_by(uid=current_user.id).first()
+    user_info = get_current_user_info()
     if not user_info:
         return redirect("/")
 
@@ -1360,17 +1390,20 @@ def searchSection():
 @login_required
 def searchViewBooks(section_id):
 
-    book_authors = get_all_book_authors()
-
     search_word = request.args.get("search_word", default="")
-    books = findBooks(search_word, filter_section=section_id)
+    books = search_books(search_word, filter_section=section_id)
+    book_authors = get_book_authors(book.id for book in books)
 
-    user_info = UserInfoModel.query.filter_by(uid=current_user.id).first()
+    user_info = get_current_user_info()
     if not user_info:
         flash("User Info not found")
         return redirect("/")
 
-    book_issues = BookIssueModel.query.filter_by(uid=current_user.id).all()
+    book_issues = (
+        BookIssueModel.query.filter_by(uid=current_user.id)
+        .filter(issue_not_expired())
+        .all()
+    )
     book_requests = BookRequestsModel.query.filter_by(uid=current_user.id).all()
 
     my_books = []
@@ -1393,21 +1426,33 @@ def searchViewBooks(section_id):
 @login_required
 def searchRequestBooks():
 
-    book_authors = get_all_book_authors()
-
     search_word = request.args.get("search_word", default="")
-    books = findBooks(search_word)
+    limit, after, before = page_args()
 
-    user_info = UserInfoModel.query.filter_by(uid=current_user.id).first()
+    user_info = get_current_user_info()
     if not user_info:
         flash("User info does not exist")
         return redirect("/")
 
+    if request.args.get("mode") == "content":
+        return render_template(
+            "search_content.html",
+            hits=search_pages(search_word, limit=limit),
+            search_word=search_word,
+            role=user_info.role,
+        )
+
+    page = search_books_page(search_word, after=after, before=before, limit=limit)
+    prev_url, next_url = page_links(page)
+    book_authors = get_book_authors(book.id for book in page.items)
+
     return render_template(
         "search_allBooks.html",
-        books=books,
+        books=page.items,
         book_authors=book_authors,
         role=user_info.role,
+        prev_url=prev_url,
+        next_url=next_url,
     )
 
 
@@ -1416,23 +1461,22 @@ def searchRequestBooks():
 @check_role(role="General")
 def searchGeneralBooks():
 
-    book_authors = get_all_book_authors()
-
     search_word = request.args.get("search_word", default="")
-    books = findBooks(search_word)
+    books = search_books(search_word)
 
     book_requests = BookRequestsModel.query.filter_by(uid=current_user.id).all()
-    book_issues = BookIssueModel.query.filter_by(uid=current_user.id).all()
+    book_issues = (
+        BookIssueModel.query.filter_by(uid=current_user.id)
+        .filter(issue_not_expired())
+        .all()
+    )
 
-    requested, issued = [], []
-    for book in books:
-        for req in book_requests:
-            if book.id == req.book_id:
-                requested.append(book)
+    requested_ids = {req.book_id for req in book_requests}
+    issued_ids = {issue.book_id for issue in book_issues}
 
-        for issue in book_issues:
-            if book.id == issue.book_id:
-                issued.append(book)
+    requested = [book for book in books if book.id in requested_ids]
+    issued = [book for book in books if book.id in issued_ids]
+    book_authors = get_book_authors(book.id for book in requested + issued)
 
     return render_template(
         "search_generalBooks.html",
@@ -1456,21 +1500,10 @@ def buyBook():
     if request.method == "GET":
         return render_template("buyBook.html", book=book)
 
-    buy_history = BuyHistoryModel.query.filter_by(
-        uid=current_user.id, book_id=book.id
-    ).first()
-    if buy_history:
+    if not record_purchase(current_user.id, book.id, book.price):  # type: ignore
         flash("You have already bought this book")
-    else:
-        buy_history = BuyHistoryModel(uid=current_user.id, book_id=book.id, bought_at=datetime.now())  # type: ignore
-        db.session.add(buy_history)
-        db.session.commit()
 
-    return send_from_directory(
-        app.config["UPLOAD_FOLDER"],
-        book.content.replace("books/", "", 1),
-        as_attachment=True,
-    )
+    return send_book(book, as_attachment=True)
 
 
 @app.route("/download")
@@ -1483,12 +1516,133 @@ def route():
         flash("Book not found")
         return redirect(f"/download?id={id}")
 
-    return send_from_directory(
-        app.config["UPLOAD_FOLDER"],
-        book.content.replace("books/", "", 1),
-        as_attachment=True,
-    )
+    return send_book(book, as_attachment=True)
+
+
+@app.cli.command("upgrade-db")
+def upgradeDb():
+    upgrade_database()
+    print("Database is up to date")
+
+
+@app.cli.command("sweep-expired-issues")
+def sweepExpiredIssues():
+    deleted = sweep_expired_issues()
+    print(f"Removed {deleted} expired book issues")
+
+
+@app.cli.command("rebuild-search-index")
+def rebuildSearchIndex():
+    book_count = rebuild_search_index()
+    print(f"Search index rebuilt with {book_count} books")
+
+
+@app.cli.command("migrate-blobs")
+def migrateBlobs():
+    migrated = migrate_legacy_books()
+    print(f"Moved {migrated} books into the blob store")
+
+
+@app.cli.command("gc-blobs")
+def gcBlobs():
+    removed = collect_garbage()
+    print(f"Removed {removed} unreferenced book PDFs")
+    removed = remove_stale_uploads()
+    print(f"Removed {removed} abandoned uploads")
+
+
+@app.cli.command("import-books")
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False))
+@click.argument("pdf_dir", type=click.Path(exists=True, file_okay=False))
+@click.option("--batch-size", default=default_batch_size, show_default=True)
+@click.option("--workers", default=default_workers, show_default=True)
+def importBooks(manifest, pdf_dir, batch_size, workers):
+    """Add the books listed in a CSV or JSONL manifest, with PDFs from pdf_dir."""
+    result = import_books(manifest, pdf_dir, batch_size=batch_size, workers=workers)
+    for error in result.errors:
+        print(error)
+    print(f"Imported {result.imported} books, skipped {len(result.errors)} rows")
+    if result.imported:
+        print("Run flask index-book-text to make their text searchable")
+
+
+@app.cli.command("export-catalogue")
+@click.argument("out_dir", type=click.Path(file_okay=False))
+@click.option(
+    "--format", "format", type=click.Choice(export_formats), default="ndjson", show_default=True
+)
+@click.option("--table", "tables", type=click.Choice(list(export_models)), multiple=True)
+def exportCatalogue(out_dir, format, tables):
+    """Write the catalogue tables to out_dir, all of them unless --table is given."""
+    if format != "ndjson" and pyarrow is None:
+        raise click.ClickException(f"pyarrow is needed for {format} output")
+
+    for name, path in export_catalogue(out_dir, format, tables).items():
+        print(f"Exported {name} to {path}")
+
+
+@app.cli.command("index-book-text")
+def indexBookText():
+    indexed = index_missing_pages()
+    print(f"Indexed the text of {indexed} book PDFs")
+
+
+@app.cli.command("rebuild-ratings")
+def rebuildRatings():
+    rated = rebuild_ratings()
+    print(f"Rebuilt the rating aggregates of {rated} books")
+
+
+@app.cli.command("kdf-benchmark")
+@click.option("--method", "methods", multiple=True, help="Hash method to time; repeat for several.")
+@click.option("--rounds", default=20, show_default=True)
+def kdfBenchmark(methods, rounds):
+    print(f"Configured method: {app.config['PASSWORD_HASH_METHOD']}, cores: {os.cpu_count()}")
+    for result in benchmark_kdf(list(methods) or benchmark_methods, rounds):
+        print(
+            f"{result['method']:<24} {result['ms_per_login']:8.1f} ms/login "
+            f"{result['logins_per_second_per_core']:8.1f} logins/s per core"
+        )
+
+
+@app.cli.command("search-benchmark")
+@click.option("--size", "sizes", multiple=True, type=int, help="Catalogue size to time; repeat for several.")
+@click.option("--word", default="topic42", show_default=True)
+@click.option("--rounds", default=3, show_default=True)
+def searchBenchmark(sizes, word, rounds):
+    print(f"{'books':>8} {'all books':>10} {'per book':>9} {'MATCH':>9} {'LIKE':>9} {'list merge':>11}")
+    for result in search_benchmark(list(sizes) or [10000, 50000, 100000], word, rounds):
+        list_merge = result["list_merge_ms"]
+        print(
+            f"{result['books']:>8} {result['broad_ms']:>8.1f}ms {result['broad_us_per_book']:>7.2f}us "
+            f"{result['match_ms']:>7.2f}ms {result['like_ms']:>7.1f}ms "
+            + (f"{list_merge:>9.0f}ms" if list_merge is not None else f"{'skipped':>11}")
+        )
+
+
+@app.cli.command("sqlite-benchmark")
+@click.option("--profile", "profiles", multiple=True, help="SQLITE_PROFILE to time; repeat for several.")
+@click.option("--readers", default=4, show_default=True)
+@click.option("--seconds", default=5.0, show_default=True)
+def sqliteBenchmark(profiles, readers, seconds):
+    print(f"{'profile':<8} {'reads/s':>9} {'p99 read':>9} {'max read':>9} {'read errors':>12} {'writes/s':>9}")
+    for result in sqlite_benchmark(list(profiles) or ["default", "wal"], readers, seconds):
+        print(
+            f"{result['profile']:<8} {result['reads_per_second']:>9.0f} {result['read_p99_ms']:>7.2f}ms "
+            f"{result['read_max_ms']:>7.1f}ms {result['read_errors']:>12} {result['writes_per_second']:>9.0f}"
+        )
+
+
+@app.cli.command("rebuild-purchase-summaries")
+def rebuildPurchaseSummaries():
+    purchases = rebuild_purchase_summaries()
+    print(f"Rebuilt the daily revenue and spend summaries from {purchases} purchases")
 
 
 if __name__ == "__main__":
+    # Only the process serving requests sweeps: not CLI commands, tests or
+    # the reloader's watcher. Other servers run "flask sweep-expired-issues"
+    # from one scheduled job; reads skip expired issues either way.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_issue_sweeper(app)
     app.run(debug=True)
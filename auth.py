@@ -0,0 +1,28 @@
+from flask import g
+from flask_login import current_user
+from models import db, UserLoginModel, UserInfoModel
+
+
+def load_user(id):
+    """Fetch a user's login and info rows together, keeping the info for this request."""
+    row = (
+        db.session.query(UserLoginModel, UserInfoModel)
+        .outerjoin(UserInfoModel, onclause=UserInfoModel.uid == UserLoginModel.id)
+        .filter(UserLoginModel.id == id)
+        .first()
+    )
+    if not row:
+        return None
+
+    user_login, user_info = row
+    g.user_info = (user_login.id, user_info)
+    return user_login
+
+
+def get_current_user_info():
+    """UserInfoModel row of the logged in user, queried at most once per request."""
+    uid = current_user.id
+    cached = g.get("user_info")
+    if cached is None or cached[0] != uid:
+        g.user_info = (uid, UserInfoModel.query.filter_by(uid=uid).first())
+    return g.user_info[1]
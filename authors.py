@@ -0,0 +1,21 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List
+from models import BookAuthorModel
+
+
+def get_book_authors(book_ids: Iterable[int]) -> Dict[int, List[str]]:
+    """Author names of each of book_ids, fetched with one IN (...) query."""
+    book_ids = set(book_ids)
+    book_authors: Dict[int, List[str]] = defaultdict(list)
+    if not book_ids:
+        return book_authors
+
+    rows = (
+        BookAuthorModel.query.filter(BookAuthorModel.book_id.in_(book_ids))
+        .with_entities(BookAuthorModel.book_id, BookAuthorModel.author_name)
+        .all()
+    )
+    for book_id, author_name in rows:
+        book_authors[book_id].append(author_name)
+
+    return book_authors
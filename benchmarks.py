@@ -0,0 +1,252 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date
+from sqlalchemy import create_engine, insert, text
+from typing import Callable, List
+from db_profile import apply_pragmas, sqlite_profiles
+from models import db, BookModel, BookAuthorModel, BookRequestsModel, SectionModel
+from search import match_source, raw, search_index_ddl, search_query
+
+# Benchmarks run against a scratch database in a temporary directory, never
+# against the app's own db.sqlite3.
+topic_count = 100
+author_count = 1000
+section_count = 20
+
+# Hits past this are too slow to merge the old way, one list rebuild per row
+max_list_merge_hits = 20000
+
+# Rows the concurrency benchmark starts from, and rows per write transaction
+sqlite_benchmark_rows = 20000
+sqlite_benchmark_batch = 200
+
+
+def best_time(function: Callable, rounds: int) -> float:
+    """Fastest of rounds calls of function, in seconds."""
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def add_scratch_books(connection, start: int, stop: int):
+    """Books with ids start + 1 to stop, each with one author; every topic word is in 1% of the books."""
+    books = []
+    authors = []
+    for book_id in range(start + 1, stop + 1):
+        name = f"The topic{book_id % topic_count:02d} handbook"
+        isbn = f"{book_id:013d}"
+        author_name = f"Author {book_id % author_count:03d}"
+        books.append(
+            {
+                "id": book_id,
+                "isbn": isbn,
+                "name": name,
+                "page_count": 100,
+                "content": "books/benchmark.pdf",
+                "publisher": "Benchmark",
+                "volume": 1,
+                "section_id": book_id % section_count + 1,
+                "price": 100,
+                "search_word": raw(isbn) + raw(name) + raw("Benchmark") + "1" + "100",
+            }
+        )
+        authors.append(
+            {"book_id": book_id, "author_name": author_name, "search_word": raw(author_name)}
+        )
+    connection.execute(insert(BookModel.__table__), books)
+    connection.execute(insert(BookAuthorModel.__table__), authors)
+
+
+def like_search(connection, word: str) -> list:
+    """The LIKE queries search used before the index, one per match source, merged by id."""
+    like_word = "%" + word + "%"
+    hits = {}
+    for sql in (
+        "SELECT id FROM book WHERE search_word LIKE :word",
+        "SELECT book_id FROM book_author WHERE search_word LIKE :word",
+        "SELECT book.id FROM book JOIN section ON section.id = book.section_id "
+        "WHERE section.search_word LIKE :word",
+    ):
+        for (book_id,) in connection.execute(text(sql), {"word": like_word}):
+            hits.setdefault(book_id, None)
+    return list(hits)
+
+
+def list_merge(book_ids: List[int]) -> list:
+    """The old per-row de-duplication, which rebuilt the hit list for every row."""
+    all_hits = []
+    for book_id in book_ids:
+        if book_id not in [hit for hit in all_hits]:
+            all_hits.append(book_id)
+    return all_hits
+
+
+def search_benchmark(sizes: List[int], word: str = "topic42", rounds: int = 3) -> List[dict]:
+    """Time search at each catalogue size in sizes, growing one scratch database.
+
+    For each size this times the broad query sent by /viewAllBooks (every
+    book, so the merge cost is the whole result), the indexed MATCH query and
+    the old LIKE scans for word, and the old list-based merge of every book
+    while it still finishes in reasonable time.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'benchmark.sqlite3')}")
+        db.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(
+                insert(SectionModel.__table__),
+                [
+                    {
+                        "id": section_id,
+                        "name": f"Section {section_id}",
+                        "date_created": date.today(),
+                        "description": "Benchmark",
+                        "search_word": f"section{section_id}",
+                    }
+                    for section_id in range(1, section_count + 1)
+                ],
+            )
+            for statement in search_index_ddl:
+                connection.execute(text(statement))
+
+        everything = search_query("")[0].order_by(BookModel.id).statement
+        matching, match_word = search_query(word)
+        matching = matching.order_by(match_source(match_word), BookModel.id).statement
+
+        size = 0
+        for target in sorted(sizes):
+            with engine.begin() as connection:
+                add_scratch_books(connection, size, target)
+            size = target
+
+            with engine.connect() as connection:
+                broad = best_time(lambda: connection.execute(everything).all(), rounds)
+                indexed = best_time(lambda: connection.execute(matching).all(), rounds)
+                scanned = best_time(lambda: like_search(connection, match_word), rounds)
+                book_ids = [row.id for row in connection.execute(everything)]
+
+            merged = None
+            if len(book_ids) <= max_list_merge_hits:
+                merged = best_time(lambda: list_merge(book_ids), 1)
+
+            results.append(
+                {
+                    "books": size,
+                    "broad_ms": broad * 1000,
+                    "broad_us_per_book": broad * 1e6 / size,
+                    "match_ms": indexed * 1000,
+                    "like_ms": scanned * 1000,
+                    "list_merge_ms": None if merged is None else merged * 1000,
+                }
+            )
+        engine.dispose()
+    return results
+
+
+def sqlite_workload(path: str, pragmas: dict, readers: int, seconds: float) -> dict:
+    """One writer committing batches while readers page through book_request.
+
+    Every thread opens its own connection with the profile's pragmas, the way
+    the app's pool does. Each read is the /api/viewBooks-sized lookup of one
+    user's requests; each write inserts a batch of requests in one transaction.
+    """
+    stop = threading.Event()
+    latencies = []
+    errors = []
+    writes = [0]
+    lock = threading.Lock()
+
+    def connect():
+        connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        apply_pragmas(connection, pragmas)
+        return connection
+
+    def read(number):
+        connection = connect()
+        timings = []
+        failed = 0
+        uid = number
+        while not stop.is_set():
+            uid = (uid + readers) % 1000
+            started = time.perf_counter()
+            try:
+                connection.execute(
+                    "SELECT book_id, date_of_request FROM book_request WHERE uid = ? LIMIT 20", (uid,)
+                ).fetchall()
+            except sqlite3.OperationalError:
+                failed += 1
+                continue
+            timings.append(time.perf_counter() - started)
+        connection.close()
+        with lock:
+            latencies.extend(timings)
+            errors.append(failed)
+
+    def write():
+        connection = connect()
+        book_id = sqlite_benchmark_rows
+        while not stop.is_set():
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany(
+                    "INSERT INTO book_request (book_id, uid, date_of_request, issue_time) "
+                    "VALUES (?, ?, '2024-01-01', 7)",
+                    [(book_id + i, (book_id + i) % 1000) for i in range(sqlite_benchmark_batch)],
+                )
+                connection.execute("COMMIT")
+            except sqlite3.OperationalError:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                continue
+            book_id += sqlite_benchmark_batch
+            writes[0] += 1
+        connection.close()
+
+    threads = [threading.Thread(target=read, args=(number,)) for number in range(readers)]
+    threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        "reads_per_second": len(latencies) / seconds,
+        "read_p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+        "read_max_ms": latencies[-1] * 1000 if latencies else None,
+        "read_errors": sum(errors),
+        "writes_per_second": writes[0] * sqlite_benchmark_batch / seconds,
+    }
+
+
+def sqlite_benchmark(profiles: List[str], readers: int = 4, seconds: float = 5) -> List[dict]:
+    """Run sqlite_workload once per SQLITE_PROFILE on a fresh scratch database."""
+    results = []
+    for profile in profiles:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "benchmark.sqlite3")
+            engine = create_engine(f"sqlite:///{path}")
+            db.metadata.create_all(engine, tables=[BookRequestsModel.__table__])
+            with engine.begin() as connection:
+                connection.execute(
+                    insert(BookRequestsModel.__table__),
+                    [
+                        {"book_id": book_id, "uid": book_id % 1000, "date_of_request": date.today(), "issue_time": 7}
+                        for book_id in range(sqlite_benchmark_rows)
+                    ],
+                )
+            engine.dispose()
+
+            result = sqlite_workload(path, sqlite_profiles[profile]["pragmas"], readers, seconds)
+            result["profile"] = profile
+            results.append(result)
+    return results
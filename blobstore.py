@@ -0,0 +1,219 @@
+import hashlib
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import bindparam, delete, exists, func, insert, select
+from typing import BinaryIO, Optional
+from models import db, BlobClaimModel, BookModel
+
+# Book PDFs are stored once per distinct content under
+# <UPLOAD_FOLDER>/blobs/<first two hex digits>/<sha256>.pdf and BookModel.content
+# holds the hex digest. Rows from before the store still hold "books/<filename>".
+legacy_prefix = "books/"
+chunk_size = 1024 * 1024
+
+sha256_pattern = re.compile(r"[0-9a-f]{64}")
+
+# A blob placed in the store gets a blob_claim row until the transaction that
+# makes a book refer to it drops the claim (claim_blob), so release_blob and
+# collect_garbage never delete a blob that is about to be used. Claims left by
+# a crashed request are dropped after claim_expiry.
+claim_expiry = timedelta(days=1)
+
+drop_claim = delete(BlobClaimModel).where(
+    BlobClaimModel.id
+    == select(func.min(BlobClaimModel.id))
+    .where(BlobClaimModel.content == bindparam("claimed_content"))
+    .scalar_subquery()
+)
+
+
+def blob_root() -> str:
+    return os.path.join(current_app.config["UPLOAD_FOLDER"], "blobs")
+
+
+def is_blob(content: str) -> bool:
+    return bool(sha256_pattern.fullmatch(content))
+
+
+def blob_path(content: str) -> str:
+    """Path of the PDF a BookModel.content value refers to."""
+    if is_blob(content):
+        return os.path.join(blob_root(), content[:2], content + ".pdf")
+    return os.path.join(
+        current_app.config["UPLOAD_FOLDER"], content.replace(legacy_prefix, "", 1)
+    )
+
+
+def content_version(content: str) -> str:
+    """Short token that changes whenever content's PDF does, for cache busting.
+
+    Needs no file access: blobs are named by their digest, and a legacy path
+    is never written again once the book refers to it.
+    """
+    if is_blob(content):
+        return content[:16]
+    return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+
+@contextmanager
+def store_lock():
+    """Hold the database write lock while the store's files are changed.
+
+    Runs on its own connection, so call it before the session writes anything
+    in the current transaction, or after committing.
+    """
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        connection.execute(
+            delete(BlobClaimModel).where(BlobClaimModel.claimed_at < datetime.now() - claim_expiry)
+        )
+        yield connection
+        connection.commit()
+
+
+def place_blob(temp_path: str, content: str):
+    """Rename a finished temporary file into place as content's blob, claiming it."""
+    path = blob_path(content)
+    with store_lock() as connection:
+        connection.execute(insert(BlobClaimModel).values(content=content, claimed_at=datetime.now()))
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store_stream(stream: BinaryIO) -> str:
+    """Write stream into the store, hashing it on the way, and return its digest.
+
+    The data goes to a temporary file next to the blobs and is renamed into
+    place, so a blob is never seen half written. Content that is already
+    stored is not written again.
+    """
+    os.makedirs(blob_root(), exist_ok=True)
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(suffix=".part", dir=blob_root())
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                temp_file.write(chunk)
+
+        content = digest.hexdigest()
+        place_blob(temp_path, content)
+        return content
+
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def store_file(path: str) -> str:
+    with open(path, "rb") as source:
+        return store_stream(source)
+
+
+def release_blob(content: str, claimed: bool = False) -> bool:
+    """Delete content's PDF once no book or claim refers to it; call after committing the change.
+
+    claimed drops the caller's own claim first, for a blob it placed but
+    never got a book to refer to.
+    """
+    with store_lock() as connection:
+        if claimed:
+            connection.execute(drop_claim, {"claimed_content": content})
+
+        referenced = connection.execute(
+            select(
+                exists().where(BookModel.content == content)
+                | exists().where(BlobClaimModel.content == content)
+            )
+        ).scalar()
+        if referenced:
+            return False
+
+        path = blob_path(content)
+        if os.path.exists(path):
+            os.remove(path)
+    return True
+
+
+@contextmanager
+def claim_blob(content: Optional[str]):
+    """Guard the transaction that makes a book refer to content, as placed by the store.
+
+    Commit inside the block: the claim is dropped in the same transaction as
+    the book change. If the block fails the session is rolled back and the
+    blob is released again, so a failed insert leaves no stray file. Pass
+    None when the change stores no new PDF.
+    """
+    if content is not None:
+        db.session.execute(drop_claim, {"claimed_content": content})
+    try:
+        yield content
+    except BaseException:
+        db.session.rollback()
+        if content is not None:
+            release_blob(content, claimed=True)
+        raise
+
+
+def collect_garbage() -> int:
+    """Remove every stored blob no book or claim refers to."""
+    root = blob_root()
+    if not os.path.isdir(root):
+        return 0
+
+    removed = 0
+    with store_lock() as connection:
+        referenced = {
+            content
+            for (content,) in connection.execute(
+                select(BookModel.content).union(select(BlobClaimModel.content))
+            )
+            if is_blob(content)
+        }
+
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                content, extension = os.path.splitext(filename)
+                if extension == ".pdf" and is_blob(content) and content not in referenced:
+                    os.remove(os.path.join(directory, filename))
+                    removed += 1
+    return removed
+
+
+def migrate_legacy_books() -> int:
+    """Move books still stored under their upload filename into the blob store."""
+    migrated = 0
+    legacy_books = BookModel.query.filter(BookModel.content.like(legacy_prefix + "%")).all()
+    for book in legacy_books:
+        legacy_content = book.content
+        legacy_path = blob_path(legacy_content)
+        if not os.path.exists(legacy_path):
+            continue
+
+        content = store_file(legacy_path)
+        with claim_blob(content):
+            book.content = content
+            db.session.commit()
+        release_blob(legacy_content)
+        migrated += 1
+
+    return migrated
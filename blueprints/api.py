@@ -1,6 +1,7 @@
 from distutils.command import upload
+import hashlib
 import os
-from flask import Blueprint, request
+from flask import Blueprint, Response, request, stream_with_context
 from flask_restful import Resource, reqparse, Api
 from flask_login import (
     LoginManager,
@@ -10,6 +11,13 @@ from flask_login import (
     login_required,
 )
 from traitlets import default
+from auth import get_current_user_info, load_user
+from authors import get_book_authors
+from blobstore import claim_blob, release_blob, store_stream
+from book_feedback import save_feedback, valid_rating
+from circulation import Decision, request_book, request_messages, review_requests, review_summary
+from expiry import issue_not_expired
+from export import arrow_stream, export_models, iter_rows, pyarrow
 from models import (
     db,
     UserLoginModel,
@@ -20,10 +28,30 @@ from models import (
     BookRequestsModel,
     BookIssueModel,
     BookFeedbackModel,
+    BookRatingModel,
+)
+from page_text import schedule_page_extraction, search_pages
+from pagination import id_page, keyset_page, link_header, page_args
+from passwords import LoginBusy, hash_password, verify_password
+from previews import ensure_preview
+from purchases import purchase_json, purchase_reports, purchases_page, purchases_query
+from ratings import get_book_rating, rating_cursor_keys, rating_json, rating_order
+from search import search_books_page
+from sqlalchemy import func, select
+from streaming import ndjson_response, stream_query, stream_requested
+from uploads import (
+    UploadError,
+    append_chunk,
+    cancel_upload,
+    finish_upload,
+    start_upload,
+    upload_offset,
+    upload_size,
 )
 from typing import List, Callable
 from datetime import date, timedelta
 import werkzeug
+from werkzeug.http import quote_etag
 from werkzeug.utils import secure_filename
 
 api_bp = Blueprint("api", __name__)
@@ -72,9 +100,9 @@ addBookArg.add_argument("price", type=str, location="form")
 addBookArg.add_argument(
     "book_file", type=werkzeug.datastructures.FileStorage, location="files"
 )
+addBookArg.add_argument("upload_id", type=str, location="form")
 
 allowed_extensions = ["pdf"]
-upload_folder = os.getcwd() + "/static/books"
 
 
 def raw(input: str) -> str:
@@ -89,7 +117,7 @@ def isFileAllowed(filename: str):
 def check_role(role: str):
     def decorator(function: Callable):
         def wrapper(*args, **kwargs):
-            info = UserInfoModel.query.filter_by(uid=current_user.id).first()
+            info = get_current_user_info()
 
             if not info:
                 return {"message": "Info not found"}, 404
@@ -108,9 +136,7 @@ def check_role(role: str):
 login_manager = LoginManager()
 
 
-@login_manager.user_loader
-def load_user(id):
-    return UserLoginModel.query.get(id)
+login_manager.user_loader(load_user)
 
 
 class AddUser(Resource):
@@ -129,7 +155,15 @@ class AddUser(Resource):
             if not first_name:
                 return {"message": "first_name not provided"}, 400
 
-            userLogin = UserLoginModel(username=username, password=password)  # type: ignore
+            if not password:
+                return {"message": "password not provided"}, 400
+
+            try:
+                password_hash = hash_password(password)
+            except LoginBusy:
+                return {"message": "Too many sign ups at once, try again"}, 503, {"Retry-After": "1"}
+
+            userLogin = UserLoginModel(username=username, password=password_hash)  # type: ignore
             db.session.add(userLogin)
             db.session.commit()
 
@@ -141,7 +175,6 @@ class AddUser(Resource):
 
             return {
                 "username": userLogin.username,
-                "password": userLogin.password,
                 "first_name": info.first_name,
                 "last_name": last_name,
                 "role": "General",
@@ -167,7 +200,12 @@ class Login(Resource):
                 if not info:
                     return {"message": "Info does not exist"}, 404
 
-                if userLogin.password == password:
+                try:
+                    password_matches = verify_password(userLogin, password)
+                except LoginBusy:
+                    return {"message": "Too many logins at once, try again"}, 503, {"Retry-After": "1"}
+
+                if password_matches:
                     # Password matches
                     login_user(userLogin)
                     return {
@@ -188,12 +226,8 @@ class UserInfo(Resource):
     @login_required
     def get(self):
         try:
-            userLogin = UserLoginModel.query.filter_by(id=current_user.id).first()
-
-            if not userLogin:
-                return {"message": "User does not exist"}, 404
-
-            info = UserInfoModel.query.filter_by(uid=userLogin.id).first()
+            userLogin = current_user
+            info = get_current_user_info()
 
             if not info:
                 return {"message": "User does not exist"}, 404
@@ -202,7 +236,6 @@ class UserInfo(Resource):
 
             return {
                 "username": userLogin.username,
-                "password": userLogin.password,
                 "first_name": info.first_name,
                 "last_name": last_name,
                 "role": info.role,
@@ -275,6 +308,7 @@ class AddBook(Resource):
             ]
             volume = file_args["volume"]
             price = file_args["price"]
+            upload_id = file_args["upload_id"]
 
             section = SectionModel.query.filter_by(name=section_name).first()
 
@@ -286,108 +320,175 @@ class AddBook(Resource):
             if book:
                 return {"message": "Book already exists"}, 400
 
-            if not book_file:
-                return {"message": "Book file not given"}
+            if upload_id:
+                content = finish_upload(upload_id)
+            else:
+                if not book_file:
+                    return {"message": "Book file not given"}
 
-            if not book_file.filename:
-                return {"message": "No file name"}, 400
+                if not book_file.filename:
+                    return {"message": "No file name"}, 400
 
-            filename = secure_filename(book_file.filename)
+                filename = secure_filename(book_file.filename)
 
-            if not isFileAllowed(filename):
-                return {"message": "This file type is not allowed"}, 400
+                if not isFileAllowed(filename):
+                    return {"message": "This file type is not allowed"}, 400
 
-            content_path = os.path.join(upload_folder, filename)
+                content = store_stream(book_file.stream)
 
-            if os.path.exists(content_path):
-                book = BookModel.query.filter_by(content="books/" + filename).first()
-                if not book:
-                    return (
-                        {
-                            "message": "There is a book pdf which exists but there is no book with the corresponding path.\
-                             Need to manually remove the pdf"
-                        },
-                        400,
-                    )
-
-                return {
-                    "message": f"This book PDF already exists and is referenced by book_id: {book.id} with name: {book.name}"
-                }, 400
-
-            book = BookModel(isbn=isbn, name=book_name, page_count=page_count, content="books/" + filename, publisher=publisher, section_id=section.id, volume=volume, search_word="hello", price=price)  # type: ignore
-            db.session.add(book)
-            db.session.commit()
-
-            for author_name in author_names_list:
-                book_author = BookAuthorModel(book_id=book.id, author_name=author_name, search_word="hello")  # type: ignore
-                db.session.add(book_author)
-            db.session.commit()
+            with claim_blob(content):
+                book = BookModel(isbn=isbn, name=book_name, page_count=page_count, content=content, publisher=publisher, section_id=section.id, volume=volume, search_word="hello", price=price)  # type: ignore
+                db.session.add(book)
+                db.session.flush()
 
-            book_file.save(content_path)
+                for author_name in author_names_list:
+                    book_author = BookAuthorModel(book_id=book.id, author_name=author_name, search_word="hello")  # type: ignore
+                    db.session.add(book_author)
+                db.session.commit()
+            ensure_preview(content)
+            schedule_page_extraction(content)
 
             return {
                 "message": f"Book {book_name} with authors {author_names} added successfully"
             }, 201
 
+        except UploadError as e:
+            return {"message": str(e)}, e.status
+
         except Exception as e:
             return {"error": str(e)}, 500
 
 
+def section_json(section) -> dict:
+    return {
+        "section_id": section.id,
+        "name": section.name,
+        "description": section.description,
+        "date_created": str(section.date_created)
+    }
+
+
 class ViewSections(Resource):
     @login_required
     def get(self):
         try:
+            if stream_requested():
+                return stream_query(SectionModel.query.order_by(SectionModel.id), section_json)
+
             sections = list(SectionModel.query.all())
 
             if not sections:
                 return {"message": "No section exists"}, 404
 
-            return [
-                {
-                    "section_id": section.id,
-                    "name": section.name,
-                    "description": section.description,
-                    "date_created": str(section.date_created)
-                }
-                for section in sections
-            ], 200
+            return [section_json(section) for section in sections], 200
 
         except Exception as e:
             return {"error": str(e)}, 500
 
 
+def book_json(book) -> dict:
+    return {
+        "id": book.id,
+        "isbn": book.isbn,
+        "name": book.name,
+        "page_count": book.page_count,
+        "content": book.content,
+        "publisher": book.publisher,
+        "section_id": book.section_id,
+        "section_name": book.section_name,
+        "authors": book.authors or "",
+        "average_rating": book.average_rating,
+        "rating_count": book.rating_count or 0,
+    }
+
+
 class ViewBooks(Resource):
     @login_required
     def get(self):
         try:
-            books = BookModel.query.all()
+            limit, after, before = page_args()
+            sort = request.args.get("sort", default="id")
+            if sort not in ("id", "rating"):
+                return {"message": "sort must be id or rating"}, 400
+
+            book_columns = [
+                BookModel.id,
+                BookModel.isbn,
+                BookModel.name,
+                BookModel.page_count,
+                BookModel.content,
+                BookModel.publisher,
+                BookModel.section_id,
+                SectionModel.name.label("section_name"),
+            ]
+
+            if sort == "rating":
+                # Driven from book_rating in ix_book_rating_rank order, with
+                # the authors of each book looked up per row, so SQLite
+                # neither groups nor sorts the catalogue
+                authors = (
+                    select(func.group_concat(BookAuthorModel.author_name, ","))
+                    .where(BookAuthorModel.book_id == BookModel.id)
+                    .scalar_subquery()
+                )
+                books = (
+                    db.session.query(
+                        *book_columns,
+                        authors.label("authors"),
+                        BookRatingModel.average_rating,
+                        BookRatingModel.rating_count,
+                    )
+                    .select_from(BookRatingModel)
+                    .join(BookModel, onclause=BookModel.id == BookRatingModel.book_id)
+                    .outerjoin(SectionModel, onclause=SectionModel.id == BookModel.section_id)
+                )
+                keys = [rating_order(), BookRatingModel.book_id]
+
+                if stream_requested():
+                    # The whole catalogue, so the page arguments don't apply
+                    return stream_query(books.order_by(*[key.desc() for key in keys]), book_json)
+
+                page = keyset_page(
+                    books,
+                    keys,
+                    after_keys=rating_cursor_keys(after),
+                    before_keys=rating_cursor_keys(before),
+                    limit=limit,
+                    descending=True,
+                )
+
+            else:
+                books = (
+                    db.session.query(BookModel)
+                    .outerjoin(SectionModel, onclause=SectionModel.id == BookModel.section_id)
+                    .outerjoin(BookAuthorModel, onclause=BookAuthorModel.book_id == BookModel.id)
+                    .outerjoin(BookRatingModel, onclause=BookRatingModel.book_id == BookModel.id)
+                    .group_by(BookModel.id)
+                    .with_entities(
+                        *book_columns,
+                        func.group_concat(BookAuthorModel.author_name, ",").label("authors"),
+                        BookRatingModel.average_rating,
+                        BookRatingModel.rating_count,
+                    )
+                )
 
-            if not books:
+                if stream_requested():
+                    # The whole catalogue, so the page arguments don't apply
+                    return stream_query(books.order_by(BookModel.id), book_json)
+
+                page = id_page(books, BookModel.id, after=after, before=before, limit=limit)
+
+            if not page.items:
                 return {"message": "No book exists"}, 404
 
             outputList = []
-            for book in books:
-                section = SectionModel.query.filter_by(id=book.section_id).first()
-                if not section:
+            for book in page.items:
+                if book.section_name is None:
                     return {"message": "Section not found"}, 404
-                
-                book_authors = BookAuthorModel.query.filter_by(book_id = book.id).all()
 
-                outputList.append(
-                    {
-                        "id": book.id,
-                        "isbn": book.isbn,
-                        "name": book.name,
-                        "page_count": book.page_count,
-                        "content": book.content,
-                        "publisher": book.publisher,
-                        "section_id": book.section_id,
-                        "section_name": section.name,
-                        "authors": ",".join([book_author.author_name for book_author in book_authors])
-                    }
-                )
+                outputList.append(book_json(book))
 
-            return outputList
+            return outputList, 200, link_header(page)
 
         except Exception as e:
             return {"error": str(e)}, 500
@@ -412,48 +513,44 @@ class RequestBook(Resource):
             if not book:
                 return {"message": "Book does not exist"}, 404
 
-            book_request = BookRequestsModel.query.filter_by(
-                book_id=book.id, uid=current_user.id
-            ).first()
-            if book_request:
-                return {"message": "Book already requested"}, 400
-
-            book_issue = BookIssueModel.query.filter_by(
-                book_id=book.id, uid=current_user.id
-            ).first()
-            if book_issue:
-                return {"message": "Book has already been issued"}, 400
-
-            today = date.today()
-            book_request = BookRequestsModel(book_id=book.id, uid=current_user.id, date_of_request=today, issue_time=issue_time)  # type: ignore
-            db.session.add(book_request)
-            db.session.commit()
+            status = request_book(book.id, current_user.id, issue_time)
+            if status in request_messages:
+                return {"message": request_messages[status], "status": status}, 400
 
             return {
                 "isbn": isbn,
-                "date_of_request": date.today(),
-                "issue_time": today,
+                "date_of_request": str(date.today()),
+                "issue_time": issue_time,
             }, 201
 
         except Exception as e:
             return {"error": str(e)}, 500
 
 
+def book_request_json(book_request) -> dict:
+    return {
+        "book_id": book_request.book_id,
+        "uid": book_request.uid,
+        "date_of_request": str(book_request.date_of_request),
+        "issue_time": book_request.issue_time,
+    }
+
+
 class ViewBookRequests(Resource):
     @login_required
     @check_role(role="Librarian")
     def get(self):
         try:
+            if stream_requested():
+                return stream_query(
+                    BookRequestsModel.query.order_by(
+                        BookRequestsModel.book_id, BookRequestsModel.uid
+                    ),
+                    book_request_json,
+                )
+
             book_requests = BookRequestsModel.query.all()
-            return [
-                {
-                    "book_id": book_request.book_id,
-                    "uid": book_request.uid,
-                    "date_of_request": str(book_request.date_of_request),
-                    "issue_time": book_request.issue_time,
-                }
-                for book_request in book_requests
-            ]
+            return [book_request_json(book_request) for book_request in book_requests]
 
         except Exception as e:
             return {"error": str(e)}, 500
@@ -463,6 +560,10 @@ class IssueBook(Resource):
     @login_required
     @check_role(role="Librarian")
     def post(self):
+        payload = request.get_json(silent=True) or {}
+        if "decisions" in payload:
+            return self.review(payload["decisions"])
+
         args = reqParser.parse_args()
         try:
             isbn = args["isbn"]
@@ -486,6 +587,9 @@ class IssueBook(Resource):
             today = date.today()
             return_date = today + timedelta(days=book_request.issue_time)
             book_issue = BookIssueModel(book_id=book.id, uid=user_login.id, date_of_issue=today, date_of_return=return_date)  # type: ignore
+
+            # An expired issue the sweeper hasn't reached yet would block the new one
+            BookIssueModel.query.filter_by(book_id=book.id, uid=user_login.id).delete()
             db.session.add(book_issue)
 
             BookRequestsModel.query.filter_by(
@@ -502,11 +606,62 @@ class IssueBook(Resource):
         except Exception as e:
             return {"error": str(e)}, 500
 
+    def review(self, decisions):
+        """Accept or reject a list of {isbn, username, accept} requests in one go."""
+        try:
+            if not isinstance(decisions, list) or not all(
+                isinstance(decision, dict) for decision in decisions
+            ):
+                return {"message": "decisions should be a list of objects"}, 400
+
+            book_ids = dict(
+                BookModel.query.filter(
+                    BookModel.isbn.in_({decision.get("isbn") for decision in decisions})
+                ).with_entities(BookModel.isbn, BookModel.id)
+            )
+            uids = dict(
+                UserLoginModel.query.filter(
+                    UserLoginModel.username.in_(
+                        {decision.get("username") for decision in decisions}
+                    )
+                ).with_entities(UserLoginModel.username, UserLoginModel.id)
+            )
+
+            results: List[dict] = []
+            known = []
+            for decision in decisions:
+                result = {
+                    "isbn": decision.get("isbn"),
+                    "username": decision.get("username"),
+                    "accept": bool(decision.get("accept", True)),
+                }
+                results.append(result)
+                if result["isbn"] not in book_ids:
+                    result["status"] = "book_not_found"
+                elif result["username"] not in uids:
+                    result["status"] = "user_not_found"
+                else:
+                    known.append(result)
+
+            reviewed = review_requests(
+                [
+                    Decision(book_ids[result["isbn"]], uids[result["username"]], result["accept"])
+                    for result in known
+                ]
+            )
+            for result, outcome in zip(known, reviewed):
+                result.update(outcome)
+
+            return {"results": results, "summary": review_summary(results)}, 200
+
+        except Exception as e:
+            return {"error": str(e)}, 500
+
 
 class ViewIssuedBooks(Resource):
     @login_required
     def get(self):
-        info = UserInfoModel.query.filter_by(uid=current_user.id).first()
+        info = get_current_user_info()
         if not info:
             return {"message": "User info does not exist"}, 404
 
@@ -522,18 +677,53 @@ class ViewIssuedBooks(Resource):
                     return {"message": "Provide username in argument"}, 400
                 return {"message": "User login not found"}, 404
 
-            book_issue = BookIssueModel.query.filter_by(uid=user_login.id).all()
+            issue_keys = (
+                BookIssueModel.query.filter_by(uid=user_login.id)
+                .filter(issue_not_expired())
+                .order_by(BookIssueModel.book_id)
+                .with_entities(
+                    BookIssueModel.book_id,
+                    BookIssueModel.date_of_issue,
+                    BookIssueModel.date_of_return,
+                )
+                .all()
+            )
+            # Clients poll this, so answer unchanged issue sets before loading any books
+            etag = hashlib.sha1(
+                repr((user_login.id, [tuple(key) for key in issue_keys])).encode()
+            ).hexdigest()
+            if request.if_none_match.contains(etag):
+                return Response(status=304, headers={"ETag": quote_etag(etag)})
+
+            issued_books = (
+                BookIssueModel.query.filter_by(uid=user_login.id)
+                .filter(issue_not_expired())
+                .outerjoin(BookModel, onclause=BookModel.id == BookIssueModel.book_id)
+                .outerjoin(SectionModel, onclause=SectionModel.id == BookModel.section_id)
+                .order_by(BookIssueModel.book_id)
+                .with_entities(
+                    BookModel.id,
+                    BookModel.isbn,
+                    BookModel.name,
+                    BookModel.page_count,
+                    BookModel.content,
+                    BookModel.publisher,
+                    BookModel.section_id,
+                    SectionModel.name.label("section_name"),
+                )
+                .all()
+            )
+
+            book_authors = get_book_authors(
+                book.id for book in issued_books if book.id is not None
+            )
 
             outputList = []
-            for issued_book in book_issue:
-                book = BookModel.query.filter_by(id=issued_book.book_id).first()
-                if not book:
+            for book in issued_books:
+                if book.id is None:
                     return {"message": "Book does not exist"}, 404
-                section = SectionModel.query.filter_by(id=book.section_id).first()
-                if not section:
+                if book.section_name is None:
                     return {"message": "Section does not exist"}, 404
-                
-                book_authors = BookAuthorModel.query.filter_by(book_id = book.id).all()
 
                 outputList.append(
                     {
@@ -543,12 +733,12 @@ class ViewIssuedBooks(Resource):
                         "content": book.content,
                         "publisher": book.publisher,
                         "section_id": book.section_id,
-                        "section_name": section.name,
-                        "authors": ",".join([author.author_name for author in book_authors])
+                        "section_name": book.section_name,
+                        "authors": ",".join(book_authors[book.id])
                     }
                 )
 
-            return outputList
+            return outputList, 200, {"ETag": quote_etag(etag)}
 
         except Exception as e:
             return {"error": str(e)}
@@ -599,8 +789,8 @@ class BookFeedback(Resource):
             feedback = args["feedback"]
             rating = args["rating"]
 
-            if rating not in range(0,11):
-                return {"message": "Rating should be in range (1, 10)"}, 400
+            if not valid_rating(rating):
+                return {"message": "Rating should be in range (0, 10)"}, 400
 
             uid = current_user.id
 
@@ -608,9 +798,7 @@ class BookFeedback(Resource):
             if not book:
                 return {"message": "Book does not exist"}, 404
 
-            book_feedback = BookFeedbackModel(book_id=book.id, uid=uid, feedback=feedback, rating=rating)  # type: ignore
-            db.session.add(book_feedback)
-            db.session.commit()
+            save_feedback(uid, book.id, feedback, rating)
 
             return {"book_id": book.id, "feedback": feedback, "rating": rating}, 200
 
@@ -618,6 +806,16 @@ class BookFeedback(Resource):
             return {"error": str(e)}, 500
 
 
+def feedback_json(feedback) -> dict:
+    return {
+        "isbn": feedback.isbn,
+        "book_id": feedback.book_id,
+        "username": feedback.uid,
+        "feedback": feedback.feedback,
+        "rating": feedback.rating,
+    }
+
+
 class ViewFeedbacks(Resource):
     @login_required
     @check_role(role="Librarian")
@@ -625,28 +823,45 @@ class ViewFeedbacks(Resource):
         try:
             isbn = request.args.get("isbn", default=None)
 
-            book = BookModel.query.filter_by(isbn=isbn).first()
-            if not book:
-                return {"message": "Book does not exist"}, 404
-
-            feedbacks = None
+            feedbacks = db.session.query(
+                BookFeedbackModel.uid,
+                BookFeedbackModel.book_id,
+                BookFeedbackModel.feedback,
+                BookFeedbackModel.rating,
+                BookModel.isbn,
+            ).join(BookModel, BookModel.id == BookFeedbackModel.book_id)
             if isbn:
-                feedbacks = BookFeedbackModel.query.filter_by(book_id=book.id).all()
-            else:
-                feedbacks = BookFeedbackModel.query.all()
+                book = BookModel.query.filter_by(isbn=isbn).first()
+                if not book:
+                    return {"message": "Book does not exist"}, 404
+                feedbacks = feedbacks.filter(BookFeedbackModel.book_id == book.id)
+
+            if stream_requested():
+                return stream_query(
+                    feedbacks.order_by(BookFeedbackModel.book_id, BookFeedbackModel.uid),
+                    feedback_json,
+                )
 
+            feedbacks = feedbacks.all()
             if not feedbacks:
                 return {"message": "No feedbacks of this book exist"}
 
-            return [
-                {
-                    "isbn": isbn,
-                    "username": feedback.uid,
-                    "feedback": feedback.feedback,
-                    "rating": feedback.rating,
-                }
-                for feedback in feedbacks
-            ]
+            return [feedback_json(feedback) for feedback in feedbacks]
+
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+
+class BookRating(Resource):
+    @login_required
+    def get(self):
+        try:
+            isbn = request.args.get("isbn", default=None)
+            book = BookModel.query.filter_by(isbn=isbn).first()
+            if not book:
+                return {"message": "Book does not exist"}, 404
+
+            return {"isbn": isbn, **rating_json(get_book_rating(book.id))}, 200
 
         except Exception as e:
             return {"error": str(e)}, 500
@@ -670,8 +885,9 @@ class EditBook(Resource):
 
             volume = file_args["volume"]
             price = file_args["price"]
+            upload_id = file_args["upload_id"]
 
-            content_path = None
+            new_file = False
             if book_file:
                 if book_file.filename:
                     filename = secure_filename(book_file.filename)
@@ -679,24 +895,7 @@ class EditBook(Resource):
                     if not isFileAllowed(filename):
                         return {"message": "This file type is not allowed"}, 400
 
-                    content_path = os.path.join(upload_folder, filename)
-
-                    if os.path.exists(content_path):
-                        book = BookModel.query.filter_by(
-                            content="books/" + filename
-                        ).first()
-                        if not book:
-                            return (
-                                {
-                                    "message": "There is a book pdf which exists but there is no book with the corresponding path.\
-                                    Need to manually remove the pdf"
-                                },
-                                500,
-                            )
-
-                        return {
-                            "message": f"This book PDF already exists and is referenced by book_id: {book.id} with name: {book.name}"
-                        }, 400
+                    new_file = True
 
             try:
                 if page_count:
@@ -713,14 +912,27 @@ class EditBook(Resource):
             if not book:
                 return {"message": "Book does not exist"}, 400
 
-            if isbn:
-                book.isbn = isbn
-
             if section_name:
                 section = SectionModel.query.filter_by(name=section_name).first()
                 if not section:
                     return {"message": "Section does not exist"}, 400
-                book.section_id = section.id
+            else:
+                section = SectionModel.query.filter_by(id=book.section_id).first()
+                if not section:
+                    return {"message": "Section does not exist"}, 500
+
+            # Stored before the book changes: the store locks the database on
+            # its own connection, which would wait on the session's pending writes
+            new_content = None
+            if upload_id:
+                new_content = finish_upload(upload_id)
+            elif new_file:
+                new_content = store_stream(book_file.stream)
+
+            if isbn:
+                book.isbn = isbn
+
+            book.section_id = section.id
 
             if name:
                 book.name = name
@@ -739,17 +951,6 @@ class EditBook(Resource):
             if page_count:
                 book.page_count = page_count
 
-            if content_path:
-                old_content = book.content
-                try:
-                    old_path = os.path.join(upload_folder, old_content[6:])
-                    old_path = old_path.replace("\\", "/")
-                    os.remove(old_path)
-                except Exception as e:
-                    return str(e)
-                book.content = "books/" + filename
-                book_file.save(content_path)
-
             if publisher:
                 book.publisher = publisher
 
@@ -759,10 +960,6 @@ class EditBook(Resource):
             if price:
                 book.price = price
 
-            section = SectionModel.query.filter_by(id=book.section_id).first()
-            if not section:
-                return {"message": "Section does not exist"}, 500
-
             book.search_word = (
                 raw(book.isbn)
                 + raw(book.name)
@@ -772,10 +969,21 @@ class EditBook(Resource):
                 + raw(str(book.page_count))
             )
 
-            db.session.commit()
+            old_content = book.content
+            with claim_blob(new_content):
+                if new_content:
+                    book.content = new_content
+                db.session.commit()
+            if book.content != old_content:
+                release_blob(old_content)
+                ensure_preview(book.content)
+                schedule_page_extraction(book.content)
 
             return {"message": "Book info changed successfully"}, 201
 
+        except UploadError as e:
+            return {"message": str(e)}, e.status
+
         except Exception as e:
             return {"error": str(e)}, 500
 
@@ -897,11 +1105,6 @@ class RemoveBook(Resource):
                 return {"message": f"Book with isbn {isbn} does not exist"}
 
             old_content = book.content
-            try:
-                old_path = os.path.join(upload_folder, old_content[6:])
-                os.remove(old_path)
-            except Exception as e:
-                return str(e)
 
             BookAuthorModel.query.filter_by(book_id=book.id).delete()
             BookModel.query.filter_by(isbn=isbn).delete()
@@ -909,6 +1112,7 @@ class RemoveBook(Resource):
             BookIssueModel.query.filter_by(book_id=book.id).delete()
             BookFeedbackModel.query.filter_by(book_id=book.id).delete()
             db.session.commit()
+            release_blob(old_content)
 
             return {"message": f"Book {book.name} deleted successfully"}
 
@@ -916,104 +1120,195 @@ class RemoveBook(Resource):
             return {"error": str(e)}, 500
 
 
+class StartUpload(Resource):
+    @login_required
+    @check_role(role="Librarian")
+    def post(self):
+        try:
+            size = request.args.get("size", type=int)
+            if size is None:
+                return {"message": "Upload size not given"}, 400
+
+            upload_id = start_upload(size)
+            return {"upload_id": upload_id, "offset": 0, "size": size}, 201
+
+        except UploadError as e:
+            return {"message": str(e)}, e.status
+
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+
+class Upload(Resource):
+    @login_required
+    @check_role(role="Librarian")
+    def get(self, upload_id):
+        try:
+            return {
+                "upload_id": upload_id,
+                "offset": upload_offset(upload_id),
+                "size": upload_size(upload_id),
+            }
+
+        except UploadError as e:
+            return {"message": str(e)}, e.status
+
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+    @login_required
+    @check_role(role="Librarian")
+    def put(self, upload_id):
+        try:
+            offset = request.args.get("offset", type=int)
+            if offset is None:
+                return {"message": "Chunk offset not given"}, 400
+
+            offset = append_chunk(upload_id, offset, request.stream)
+            return {"upload_id": upload_id, "offset": offset}
+
+        except UploadError as e:
+            return {"message": str(e)}, e.status
+
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+    @login_required
+    @check_role(role="Librarian")
+    def delete(self, upload_id):
+        try:
+            cancel_upload(upload_id)
+            return {"message": f"Upload {upload_id} cancelled"}
+
+        except UploadError as e:
+            return {"message": str(e)}, e.status
+
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+
+class ExportTable(Resource):
+    @login_required
+    @check_role(role="Librarian")
+    def get(self, table):
+        try:
+            if table not in export_models:
+                return {"message": f"Table {table} can not be exported"}, 404
+
+            format = request.args.get("format", default="ndjson")
+            if format == "ndjson":
+                return ndjson_response(iter_rows(table))
+
+            if format == "arrow":
+                if pyarrow is None:
+                    return {"message": "Arrow output is not available"}, 400
+                return Response(
+                    stream_with_context(arrow_stream(table)),
+                    mimetype="application/vnd.apache.arrow.stream",
+                )
+
+            return {"message": "format should be ndjson or arrow"}, 400
+
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+
+def date_arg(name: str):
+    """An ISO date query argument; None when absent, ValueError when malformed."""
+    value = request.args.get(name)
+    return date.fromisoformat(value) if value else None
+
+
+class Purchases(Resource):
+    @login_required
+    def get(self):
+        try:
+            user_info = get_current_user_info()
+            if not user_info:
+                return {"message": "Info not found"}, 404
+
+            limit, after, before = page_args()
+            try:
+                since, until = date_arg("from"), date_arg("to")
+            except ValueError:
+                return {"message": "from and to should be dates as YYYY-MM-DD"}, 400
+
+            # General users only ever see their own purchases
+            uid = current_user.id
+            if user_info.role == "Librarian":
+                uid = request.args.get("uid", default=None, type=int)
+
+            book_id = None
+            isbn = request.args.get("isbn", default=None)
+            if isbn:
+                book = BookModel.query.filter_by(isbn=isbn).first()
+                if not book:
+                    return {"message": "Book does not exist"}, 404
+                book_id = book.id
+
+            purchases = purchases_query(uid=uid, book_id=book_id, since=since, until=until)
+            if stream_requested():
+                return stream_query(purchases.order_by("bought_at", "id"), purchase_json)
+
+            page = purchases_page(purchases, after=after, before=before, limit=limit)
+            if not page.items:
+                return {"message": "No purchases found"}, 404
+
+            return [purchase_json(purchase) for purchase in page.items], 200, link_header(page)
+
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+
+class PurchaseReport(Resource):
+    @login_required
+    @check_role(role="Librarian")
+    def get(self):
+        try:
+            group = request.args.get("group", default="book")
+            if group not in purchase_reports:
+                return {"message": "group should be book, user or day"}, 400
+
+            try:
+                since, until = date_arg("from"), date_arg("to")
+            except ValueError:
+                return {"message": "from and to should be dates as YYYY-MM-DD"}, 400
+
+            return purchase_reports[group](since, until), 200
+
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+
 class SearchBook(Resource):
     @login_required
     def get(self):
         try:
             search_word = request.args.get("search_word", default="")
-            modified_search_word = "%" + raw(search_word) + "%"
+            limit, after, before = page_args()
 
-            all_hits = []
+            if request.args.get("mode") == "content":
+                hits = search_pages(search_word, limit=limit)
+                if len(hits) == 0:
+                    return {"message": "No page found"}, 404
 
-            book_hits = (
-                BookModel.query.filter(BookModel.search_word.like(modified_search_word))
-                .join(SectionModel, onclause=SectionModel.id == BookModel.section_id)
-                .with_entities(
-                    BookModel.id,
-                    BookModel.isbn,
-                    BookModel.name,
-                    BookModel.content,
-                    BookModel.page_count,
-                    BookModel.publisher,
-                    BookModel.volume,
-                    BookModel.section_id,
-                    BookModel.search_word,
-                    SectionModel.name.label("section_name"),
-                    BookModel.price,
-                )
-                .all()
-            )
-
-            author_hits = (
-                BookAuthorModel.query.filter(
-                    BookAuthorModel.search_word.like(modified_search_word)
-                )
-                .join(BookModel, onclause=BookAuthorModel.book_id == BookModel.id)
-                .join(SectionModel, onclause=SectionModel.id == BookModel.section_id)
-                .with_entities(
-                    BookModel.id,
-                    BookModel.isbn,
-                    BookModel.name,
-                    BookModel.content,
-                    BookModel.page_count,
-                    BookModel.publisher,
-                    BookModel.volume,
-                    BookModel.section_id,
-                    BookModel.search_word,
-                    SectionModel.name.label("section_name"),
-                    BookModel.price,
-                )
-                .all()
-            )
+                return [
+                    {
+                        "book_id": hit.book_id,
+                        "name": hit.name,
+                        "page": hit.page,
+                        "snippet": hit.snippet,
+                    }
+                    for hit in hits
+                ], 200
 
-            section_hits = (
-                SectionModel.query.filter(
-                    SectionModel.search_word.like(modified_search_word)
-                )
-                .join(BookModel, onclause=SectionModel.id == BookModel.section_id)
-                .with_entities(
-                    BookModel.id,
-                    BookModel.isbn,
-                    BookModel.name,
-                    BookModel.content,
-                    BookModel.page_count,
-                    BookModel.publisher,
-                    BookModel.volume,
-                    BookModel.section_id,
-                    BookModel.search_word,
-                    SectionModel.name.label("section_name"),
-                    BookModel.price,
-                )
-                .all()
-            )
+            page = search_books_page(search_word, after=after, before=before, limit=limit)
 
-            if book_hits:
-                for book in book_hits:
-                    # For unique books
-                    if book.id in [book_hit.id for book_hit in all_hits]:
-                        continue
-                    all_hits.append(book)
-
-            if author_hits:
-                for book in author_hits:
-                    if book.id in [book_hit.id for book_hit in all_hits]:
-                        continue
-                    all_hits.append(book)
-
-            if section_hits:
-                for book in section_hits:
-                    if book.id in [book_hit.id for book_hit in all_hits]:
-                        continue
-                    all_hits.append(book)
-
-            if len(all_hits) == 0:
+            if len(page.items) == 0:
                 return {"message": "No book found"}, 404
 
             outputList = []
-            for book in all_hits:
-                section = SectionModel.query.filter_by(id=book.section_id).first()
-                if not section:
-                    return {"message": "Section does not exist"}, 404
+            for book in page.items:
                 outputList.append(
                     {
                         "id": book.id,
@@ -1023,11 +1318,11 @@ class SearchBook(Resource):
                         "content": book.content,
                         "publisher": book.publisher,
                         "section_id": book.section_id,
-                        "section_name": section.name,
+                        "section_name": book.section_name,
                         "price": book.price,
                     }
                 )
-            return outputList
+            return outputList, 200, link_header(page)
 
         except Exception as e:
             return {"error": str(e)}, 500
@@ -1045,7 +1340,7 @@ class SearchSection(Resource):
                 SectionModel.search_word.like(modified_search_word)
             ).all()
 
-            user_info = UserInfoModel.query.filter_by(uid=current_user.id).first()
+            user_info = get_current_user_info()
             if not user_info:
                 return {"message": "User info not found"}, 404
 
@@ -1078,6 +1373,7 @@ api.add_resource(ViewIssuedBooks, "/api/viewIssuedBooks")
 api.add_resource(ReturnBook, "/api/returnBook")
 api.add_resource(BookFeedback, "/api/bookFeedback")
 api.add_resource(ViewFeedbacks, "/api/viewFeedbacks")
+api.add_resource(BookRating, "/api/bookRating")
 api.add_resource(EditBook, "/api/editBook")
 api.add_resource(EditSection, "/api/editSection")
 api.add_resource(RevokeBookAccess, "/api/revokeBookAccess")
@@ -1085,3 +1381,8 @@ api.add_resource(RemoveSection, "/api/removeSection")
 api.add_resource(RemoveBook, "/api/removeBook")
 api.add_resource(SearchBook, "/api/searchBook")
 api.add_resource(SearchSection, "/api/searchSection")
+api.add_resource(ExportTable, "/api/export/<string:table>")
+api.add_resource(Purchases, "/api/purchases")
+api.add_resource(PurchaseReport, "/api/purchases/report")
+api.add_resource(StartUpload, "/api/uploads")
+api.add_resource(Upload, "/api/uploads/<string:upload_id>")
@@ -0,0 +1,29 @@
+from sqlalchemy.dialects.sqlite import insert
+from models import db, BookFeedbackModel
+
+rating_values = range(0, 11)
+
+
+def valid_rating(rating) -> bool:
+    return rating in rating_values
+
+
+def save_feedback(uid: int, book_id: int, feedback: str, rating: int):
+    """Add or replace uid's feedback on a book with one INSERT ... ON CONFLICT DO UPDATE.
+
+    Concurrent submissions for the same user and book can't race between a
+    lookup and the write, and the existing row is updated in place.
+    """
+    statement = insert(BookFeedbackModel).values(
+        uid=uid, book_id=book_id, feedback=feedback, rating=rating
+    )
+    db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[BookFeedbackModel.uid, BookFeedbackModel.book_id],
+            set_={
+                "feedback": statement.excluded.feedback,
+                "rating": statement.excluded.rating,
+            },
+        )
+    )
+    db.session.commit()
@@ -0,0 +1,194 @@
+import csv
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import insert
+from typing import Dict, Iterator, List, NamedTuple
+from blobstore import drop_claim, release_blob, store_file
+from models import db, BookModel, BookAuthorModel, SectionModel
+from search import raw
+
+# A manifest has one book per CSV row or JSONL line with the fields below.
+# author_names is comma separated (or a list in JSONL) and file is the PDF's
+# path relative to the PDF directory.
+required_fields = ["isbn", "book_name", "publisher", "section_name", "author_names", "file"]
+integer_fields = ["page_count", "volume", "price"]
+
+default_batch_size = 500
+default_workers = 4
+
+
+class ImportResult(NamedTuple):
+    imported: int
+    errors: List[str]
+
+
+def read_manifest(path: str) -> Iterator[dict]:
+    with open(path, newline="", encoding="utf-8") as manifest:
+        if path.endswith(".jsonl"):
+            for line in manifest:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(manifest)
+
+
+def parse_row(row: dict, pdf_dir: str, sections: Dict[str, SectionModel]) -> dict:
+    """Book columns of a manifest row, plus its author names and PDF path."""
+    for field in required_fields:
+        if not row.get(field):
+            raise ValueError(f"{field} not given")
+
+    values = {}
+    for field in integer_fields:
+        try:
+            values[field] = int(row.get(field))  # type: ignore
+        except (TypeError, ValueError):
+            raise ValueError(f"{field} should be an integer")
+    if values["page_count"] < 1:
+        raise ValueError("page_count must be a positive integer")
+
+    section = sections.get(row["section_name"])
+    if not section:
+        raise ValueError(f"Section {row['section_name']} does not exist")
+
+    path = os.path.join(pdf_dir, row["file"])
+    if not os.path.isfile(path):
+        raise ValueError(f"File {row['file']} not found")
+
+    author_names = row["author_names"]
+    if isinstance(author_names, str):
+        author_names = author_names.split(",")
+
+    isbn = str(row["isbn"]).strip()
+    return {
+        "isbn": isbn,
+        "name": row["book_name"],
+        "page_count": values["page_count"],
+        "publisher": row["publisher"],
+        "volume": values["volume"],
+        "section_id": section.id,
+        "price": values["price"],
+        "search_word": raw(isbn)
+        + raw(row["book_name"])
+        + raw(row["publisher"])
+        + raw(section.name)
+        + raw(str(values["volume"]))
+        + raw(str(values["page_count"])),
+        "authors": [name.strip() for name in author_names if name.strip()],
+        "path": path,
+    }
+
+
+def store_in_app(app, path: str) -> str:
+    with app.app_context():
+        return store_file(path)
+
+
+def insert_batch(books: List[dict]):
+    """Insert a batch of books and their authors with one executemany each, in one transaction.
+
+    The store's claims on the batch's PDFs are dropped in the same transaction.
+    """
+    book_ids = dict(
+        db.session.execute(
+            insert(BookModel).returning(BookModel.isbn, BookModel.id),
+            [
+                {key: value for key, value in book.items() if key not in ("authors", "path")}
+                for book in books
+            ],
+        ).all()
+    )
+
+    author_rows = [
+        {
+            "book_id": book_ids[book["isbn"]],
+            "author_name": author_name,
+            "search_word": raw(author_name),
+        }
+        for book in books
+        for author_name in dict.fromkeys(book["authors"])
+    ]
+    if author_rows:
+        db.session.execute(insert(BookAuthorModel), author_rows)
+    # Core level: the ORM session can't run a DELETE once per parameter set
+    db.session.connection().execute(
+        drop_claim, [{"claimed_content": book["content"]} for book in books]
+    )
+    db.session.commit()
+
+
+def finish_batch(batch: List[dict], stored: List[Future], errors: List[str]) -> int:
+    """Insert the books of a batch whose PDFs were stored, returning how many went in."""
+    books = []
+    for book, future in zip(batch, stored):
+        try:
+            book["content"] = future.result()
+        except Exception as e:
+            # Unreadable files, and the store's lock timing out while a batch is inserted
+            errors.append(f"Book {book['isbn']}: {e}")
+            continue
+        books.append(book)
+
+    if not books:
+        return 0
+
+    try:
+        insert_batch(books)
+    except Exception as e:
+        db.session.rollback()
+        for book in books:
+            release_blob(book["content"], claimed=True)
+        errors.append(f"Batch starting at book {books[0]['isbn']}: {e}")
+        return 0
+
+    return len(books)
+
+
+def import_books(
+    manifest_path: str,
+    pdf_dir: str,
+    batch_size: int = default_batch_size,
+    workers: int = default_workers,
+) -> ImportResult:
+    """Add every valid book of a manifest, storing its PDF in the blob store.
+
+    Existing ISBNs and the sections are read once up front. A thread pool
+    stores the PDFs of the next batch while the current one is inserted.
+    Rows that fail validation, and batches that fail to insert, are reported
+    and skipped.
+    """
+    known_isbns = {isbn for (isbn,) in db.session.query(BookModel.isbn)}
+    sections = {section.name: section for section in SectionModel.query.all()}
+
+    errors = []
+    books = []
+    for line, row in enumerate(read_manifest(manifest_path), start=1):
+        try:
+            book = parse_row(row, pdf_dir, sections)
+        except ValueError as e:
+            errors.append(f"Row {line}: {e}")
+            continue
+
+        if book["isbn"] in known_isbns:
+            errors.append(f"Row {line}: Book {book['isbn']} already exists")
+            continue
+        known_isbns.add(book["isbn"])
+        books.append(book)
+
+    app = current_app._get_current_object()  # type: ignore
+    imported = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = None
+        for start in range(0, len(books), batch_size):
+            batch = books[start : start + batch_size]
+            stored = [executor.submit(store_in_app, app, book["path"]) for book in batch]
+            if pending:
+                imported += finish_batch(*pending, errors)
+            pending = (batch, stored)
+
+        if pending:
+            imported += finish_batch(*pending, errors)
+
+    return ImportResult(imported=imported, errors=errors)
@@ -0,0 +1,217 @@
+from collections import Counter
+from datetime import date
+from sqlalchemy import text
+from typing import Dict, List, NamedTuple, Optional
+from models import db
+from stats import invalidate_dashboard_stats
+
+# Outcomes of a review decision
+issued = "issued"
+rejected = "rejected"
+already_issued = "already_issued"
+not_requested = "not_requested"
+duplicate = "duplicate"
+
+# Outcomes of a book request
+requested = "requested"
+already_requested = "already_requested"
+quota_reached = "quota_reached"
+
+# Books a user may have requested or issued at once
+request_quota = 5
+
+request_messages = {
+    already_requested: "Book request already exists",
+    already_issued: "Book has already been issued",
+    quota_reached: f"You can only request/issue {request_quota} books at once",
+}
+
+
+class Decision(NamedTuple):
+    book_id: int
+    uid: int
+    accept: bool
+
+
+review_sql = [
+    # Work out every outcome before anything changes
+    """
+    UPDATE review_decision SET outcome = CASE
+        WHEN NOT EXISTS (
+            SELECT 1 FROM book_request
+            WHERE book_id = review_decision.book_id AND uid = review_decision.uid
+        ) THEN 'not_requested'
+        WHEN accept = 0 THEN 'rejected'
+        WHEN EXISTS (
+            SELECT 1 FROM book_issue
+            WHERE book_id = review_decision.book_id AND uid = review_decision.uid
+                AND date_of_return >= :today
+        ) THEN 'already_issued'
+        ELSE 'issued'
+    END
+    """,
+    # An expired issue the sweeper hasn't reached yet would block the new one
+    """
+    DELETE FROM book_issue WHERE (book_id, uid) IN (
+        SELECT book_id, uid FROM review_decision WHERE outcome = 'issued'
+    )
+    """,
+    """
+    INSERT INTO book_issue (book_id, uid, date_of_issue, date_of_return)
+    SELECT book_request.book_id, book_request.uid, :today,
+        date(:today, '+' || book_request.issue_time || ' days')
+    FROM book_request JOIN review_decision
+        ON review_decision.book_id = book_request.book_id
+        AND review_decision.uid = book_request.uid
+    WHERE review_decision.outcome = 'issued'
+    """,
+    """
+    DELETE FROM book_request WHERE (book_id, uid) IN (
+        SELECT book_id, uid FROM review_decision WHERE outcome IN ('issued', 'rejected')
+    )
+    """,
+]
+
+
+def review_requests(decisions: List[Decision]) -> List[dict]:
+    """Accept or reject many book requests in one transaction.
+
+    The decisions go into a temporary table, and each step is then a single
+    set-based statement over all of them. Returns one result per decision, in
+    order, with its outcome and, for issued books, the return date.
+    """
+    results = [
+        {"book_id": d.book_id, "uid": d.uid, "accept": d.accept, "status": duplicate}
+        for d in decisions
+    ]
+    first_of: Dict[tuple, int] = {}
+    for position, d in enumerate(decisions):
+        first_of.setdefault((d.book_id, d.uid), position)
+
+    if not first_of:
+        return results
+
+    today = date.today().isoformat()
+    try:
+        db.session.execute(
+            text(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS review_decision (
+                    book_id INTEGER, uid INTEGER, accept INTEGER, outcome TEXT,
+                    PRIMARY KEY (book_id, uid)
+                )
+                """
+            )
+        )
+        db.session.execute(text("DELETE FROM review_decision"))
+        db.session.execute(
+            text(
+                "INSERT INTO review_decision (book_id, uid, accept) VALUES (:book_id, :uid, :accept)"
+            ),
+            [
+                {"book_id": d.book_id, "uid": d.uid, "accept": int(d.accept)}
+                for d in (decisions[position] for position in first_of.values())
+            ],
+        )
+        for statement in review_sql:
+            db.session.execute(text(statement), {"today": today})
+
+        outcomes = db.session.execute(
+            text(
+                """
+                SELECT review_decision.book_id, review_decision.uid, outcome, date_of_return
+                FROM review_decision LEFT JOIN book_issue
+                    ON book_issue.book_id = review_decision.book_id
+                    AND book_issue.uid = review_decision.uid
+                    AND outcome = 'issued'
+                """
+            )
+        ).all()
+        db.session.execute(text("DELETE FROM review_decision"))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # Raw SQL skips the ORM events that keep the dashboard counters fresh
+    invalidate_dashboard_stats()
+
+    for book_id, uid, outcome, date_of_return in outcomes:
+        result = results[first_of[(book_id, uid)]]
+        result["status"] = outcome
+        if outcome == issued:
+            result["date_of_return"] = str(date_of_return)
+
+    return results
+
+
+def review_summary(results: List[dict]) -> Dict[str, int]:
+    return dict(Counter(result["status"] for result in results))
+
+
+def review_failures(results: List[dict]) -> List[dict]:
+    """The results of decisions that could not be applied."""
+    return [result for result in results if result["status"] not in (issued, rejected)]
+
+
+request_sql = """
+INSERT INTO book_request (book_id, uid, date_of_request, issue_time)
+SELECT :book_id, :uid, :today, :issue_time
+WHERE NOT EXISTS (
+    SELECT 1 FROM book_issue
+    WHERE book_id = :book_id AND uid = :uid AND date_of_return >= :today
+) AND (
+    (SELECT COUNT(*) FROM book_request WHERE uid = :uid)
+    + (SELECT COUNT(*) FROM book_issue WHERE uid = :uid AND date_of_return >= :today)
+) < :quota
+ON CONFLICT (book_id, uid) DO NOTHING
+"""
+
+request_status_sql = """
+SELECT CASE
+    WHEN EXISTS (SELECT 1 FROM book_request WHERE book_id = :book_id AND uid = :uid)
+        THEN 'already_requested'
+    WHEN EXISTS (
+        SELECT 1 FROM book_issue
+        WHERE book_id = :book_id AND uid = :uid AND date_of_return >= :today
+    ) THEN 'already_issued'
+    WHEN (
+        (SELECT COUNT(*) FROM book_request WHERE uid = :uid)
+        + (SELECT COUNT(*) FROM book_issue WHERE uid = :uid AND date_of_return >= :today)
+    ) >= :quota THEN 'quota_reached'
+END
+"""
+
+
+def request_status(book_id: int, uid: int) -> Optional[str]:
+    """Why uid can't request the book right now, or None if they can."""
+    return db.session.execute(
+        text(request_status_sql),
+        {"book_id": book_id, "uid": uid, "today": date.today().isoformat(), "quota": request_quota},
+    ).scalar()
+
+
+def request_book(book_id: int, uid: int, issue_time: int) -> str:
+    """Add a book request, checking the quota and duplicates in the same statement.
+
+    The INSERT only goes through when the user has no request or current issue
+    of the book and is under request_quota, so parallel submissions can't get
+    past the limit. Returns requested, or the reason nothing was inserted.
+    """
+    result = db.session.execute(
+        text(request_sql),
+        {
+            "book_id": book_id,
+            "uid": uid,
+            "today": date.today().isoformat(),
+            "issue_time": issue_time,
+            "quota": request_quota,
+        },
+    )
+    db.session.commit()
+
+    if result.rowcount == 1:
+        # Raw SQL skips the ORM events that keep the dashboard counters fresh
+        invalidate_dashboard_stats()
+        return requested
+    return request_status(book_id, uid) or quota_reached
@@ -0,0 +1,59 @@
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Connection settings by SQLITE_PROFILE name. "wal" lets readers keep going
+# while requestBook, dealWithRequest or buyBook hold the write lock.
+sqlite_profiles = {
+    "default": {
+        "pragmas": {},
+        "engine_options": {},
+    },
+    "wal": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,  # ms to wait for a lock before "database is locked"
+            "cache_size": -32000,  # negative means KiB, so 32 MB per connection
+            "mmap_size": 134217728,
+        },
+        "engine_options": {
+            "pool_size": 10,
+            "max_overflow": 10,
+            "pool_timeout": 30,
+        },
+    },
+}
+
+_pragmas = {}
+
+
+def configure_sqlite(app):
+    """Apply the SQLITE_PROFILE engine options; call before db.init_app(app).
+
+    SQLITE_PRAGMAS in the app config overrides single pragmas of the profile.
+    """
+    profile = sqlite_profiles[app.config.get("SQLITE_PROFILE", "default")]
+
+    engine_options = dict(profile["engine_options"])
+    engine_options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
+
+    _pragmas.clear()
+    _pragmas.update(profile["pragmas"])
+    _pragmas.update(app.config.get("SQLITE_PRAGMAS", {}))
+
+
+def apply_pragmas(dbapi_connection: sqlite3.Connection, pragmas: dict):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    apply_pragmas(dbapi_connection, _pragmas)
@@ -0,0 +1,45 @@
+import threading
+import time
+from datetime import date
+from models import db, BookIssueModel
+
+
+def issue_not_expired():
+    """Filter for issues still within their return date.
+
+    Expired rows stay in book_issue until the next sweep, so every read of
+    current issues goes through this instead of deleting them on the spot.
+    """
+    return BookIssueModel.date_of_return >= date.today()
+
+
+def sweep_expired_issues() -> int:
+    """Delete every issue past its return date with one DELETE on the date_of_return index."""
+    deleted = BookIssueModel.query.filter(
+        BookIssueModel.date_of_return < date.today()
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def start_issue_sweeper(app):
+    """Sweep expired issues every ISSUE_SWEEP_INTERVAL seconds in a daemon thread (0 disables)."""
+    interval = app.config.get("ISSUE_SWEEP_INTERVAL", 0)
+    if not interval:
+        return None
+
+    def sweep_forever():
+        while True:
+            with app.app_context():
+                try:
+                    sweep_expired_issues()
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.warning(f"Expired issue sweep failed: {e}")
+                finally:
+                    db.session.remove()
+            time.sleep(interval)
+
+    sweeper = threading.Thread(target=sweep_forever, name="issue-sweeper", daemon=True)
+    sweeper.start()
+    return sweeper
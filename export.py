@@ -0,0 +1,136 @@
+import io
+import os
+from datetime import date, datetime
+from sqlalchemy import select
+from typing import Dict, Iterator, List
+from models import (
+    db,
+    SectionModel,
+    BookModel,
+    BookAuthorModel,
+    BookIssueModel,
+    BookFeedbackModel,
+    BuyHistoryModel,
+)
+from streaming import ndjson_lines
+
+# Parquet and Arrow output need pyarrow, newline-delimited JSON always works
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+export_models = {
+    "sections": SectionModel,
+    "books": BookModel,
+    "authors": BookAuthorModel,
+    "issues": BookIssueModel,
+    "feedback": BookFeedbackModel,
+    "purchases": BuyHistoryModel,
+}
+
+export_formats = ["ndjson", "parquet", "arrow"]
+
+export_batch_size = 1000
+
+
+def iter_batches(name: str, batch_size: int = export_batch_size) -> Iterator[List[dict]]:
+    """Rows of an export table in primary key order, batch_size at a time.
+
+    yield_per streams the rows from the cursor, so memory use does not grow
+    with the size of the table.
+    """
+    table = export_models[name].__table__
+    result = db.session.execute(
+        select(table)
+        .order_by(*table.primary_key.columns)
+        .execution_options(yield_per=batch_size)
+    )
+    for partition in result.mappings().partitions():
+        yield [dict(row) for row in partition]
+
+
+def iter_rows(name: str) -> Iterator[dict]:
+    for batch in iter_batches(name):
+        yield from batch
+
+
+def arrow_schema(name: str):
+    arrow_types = {
+        int: pyarrow.int64(),
+        str: pyarrow.string(),
+        date: pyarrow.date32(),
+        datetime: pyarrow.timestamp("us"),
+    }
+    return pyarrow.schema(
+        [
+            (column.name, arrow_types[column.type.python_type])
+            for column in export_models[name].__table__.columns
+        ]
+    )
+
+
+def arrow_value(value, python_type):
+    # SQLite doesn't enforce column types, so coerce what can be and drop the rest
+    if value is None or isinstance(value, python_type):
+        return value
+    try:
+        return python_type(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def arrow_batch(name: str, batch: List[dict], schema):
+    """A record batch in the declared column types; values that don't fit become null."""
+    columns = export_models[name].__table__.columns
+    return pyarrow.RecordBatch.from_pydict(
+        {
+            column.name: [
+                arrow_value(row[column.name], column.type.python_type) for row in batch
+            ]
+            for column in columns
+        },
+        schema=schema,
+    )
+
+
+def arrow_stream(name: str) -> Iterator[bytes]:
+    """An export table as an Arrow IPC stream, yielded one record batch at a time."""
+    schema = arrow_schema(name)
+    sink = io.BytesIO()
+    with pyarrow.ipc.new_stream(sink, schema) as writer:
+        for batch in iter_batches(name):
+            writer.write_batch(arrow_batch(name, batch, schema))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+
+def write_table(name: str, path: str, format: str):
+    if format == "parquet":
+        schema = arrow_schema(name)
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            for batch in iter_batches(name):
+                writer.write_batch(arrow_batch(name, batch, schema))
+
+    elif format == "arrow":
+        with open(path, "wb") as output:
+            for chunk in arrow_stream(name):
+                output.write(chunk)
+
+    else:
+        with open(path, "w", encoding="utf-8") as output:
+            output.writelines(ndjson_lines(iter_rows(name)))
+
+
+def export_catalogue(out_dir: str, format: str = "ndjson", names=None) -> Dict[str, str]:
+    """Write each export table to <out_dir>/<name>.<format> and return the paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {}
+    for name in names or export_models:
+        path = os.path.join(out_dir, f"{name}.{format}")
+        write_table(name, path, format)
+        paths[name] = path
+    return paths
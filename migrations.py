@@ -0,0 +1,48 @@
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex
+from models import db, BuyHistoryModel
+
+
+def upgrade_database():
+    """Bring an existing database up to date with models.py.
+
+    Creates missing tables, then any declared index missing from a table that
+    already existed. Safe to run on every start.
+    """
+    db.create_all()
+
+    columns = {column["name"] for column in inspect(db.engine).get_columns("buy_history")}
+    if "id" not in columns:
+        rebuild_buy_history()
+
+    # IF NOT EXISTS rather than checkfirst, which can't see expression indexes
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def rebuild_buy_history():
+    """Move buy_history from its (uid, book_id) key to an id column and a stored price.
+
+    Purchases keep their order. Each is priced at its book's current price,
+    the closest record there is of what was paid. The summary triggers go
+    with the old table, so create_purchase_summaries rebuilds the summaries.
+    """
+    with db.engine.connect() as connection:
+        # One transaction for the DDL too, so a failure leaves the old table
+        connection.exec_driver_sql("BEGIN")
+        connection.exec_driver_sql("ALTER TABLE buy_history RENAME TO buy_history_old")
+        connection.exec_driver_sql("DROP INDEX IF EXISTS ix_buy_history_bought_at")
+        BuyHistoryModel.__table__.create(connection)
+        connection.exec_driver_sql(
+            """
+            INSERT INTO buy_history (uid, book_id, bought_at, price)
+            SELECT buy_history_old.uid, buy_history_old.book_id, buy_history_old.bought_at,
+                COALESCE(book.price, 0)
+            FROM buy_history_old LEFT JOIN book ON book.id = buy_history_old.book_id
+            ORDER BY buy_history_old.bought_at, buy_history_old.rowid
+            """
+        )
+        connection.exec_driver_sql("DROP TABLE buy_history_old")
+        connection.commit()
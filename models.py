@@ -1,5 +1,5 @@
 from enum import auto
-from sqlalchemy import Date, Integer, String, Column, ForeignKey, DateTime, distinct, null
+from sqlalchemy import Date, Float, Index, Integer, String, Column, ForeignKey, DateTime, UniqueConstraint, distinct, func, literal_column, null
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
 
@@ -11,7 +11,7 @@ class UserLoginModel(db.Model, UserMixin):
     __tablename__ = "user_login"
     id = Column(Integer, primary_key=True, autoincrement=True)
     username = Column(String(40), unique=True, nullable=False)
-    password = Column(String(80), nullable=False)
+    password = Column(String(255), nullable=False)
 
 
 class UserInfoModel(db.Model):
@@ -37,10 +37,10 @@ class BookModel(db.Model):
     isbn = Column(String(13), nullable=False, unique=True)
     name = Column(String(100), nullable=False)
     page_count = Column(Integer, nullable=False)
-    content = Column(String, nullable=False)
+    content = Column(String, nullable=False, index=True)
     publisher = Column(String(100), nullable=False)
     volume = Column(Integer, nullable = False)
-    section_id = Column(Integer, ForeignKey("section.id"), nullable=False)
+    section_id = Column(Integer, ForeignKey("section.id"), nullable=False, index=True)
     search_word = Column(String(500), nullable=False)
     price = Column(Integer, nullable=False)
 
@@ -55,7 +55,7 @@ class BookAuthorModel(db.Model):
 class BookRequestsModel(db.Model):
     __tablename__ = "book_request"
     book_id = Column(Integer, ForeignKey("book.id"), primary_key=True)
-    uid = Column(Integer, ForeignKey("user_login.id"), primary_key=True)
+    uid = Column(Integer, ForeignKey("user_login.id"), primary_key=True, index=True)
     date_of_request = Column(Date, nullable=False)
     issue_time = Column(Integer, nullable=False)
 
@@ -65,18 +65,79 @@ class BookIssueModel(db.Model):
     book_id = Column(Integer, ForeignKey("book.id"), primary_key=True)
     uid = Column(Integer, ForeignKey("user_login.id"), primary_key=True)
     date_of_issue = Column(Date, nullable=False)
-    date_of_return = Column(Date, nullable=False)
+    date_of_return = Column(Date, nullable=False, index=True)
+
+    # A user's current issues: uid=? AND date_of_return >= today
+    __table_args__ = (Index("ix_book_issue_uid_date_of_return", uid, date_of_return),)
 
 
 class BookFeedbackModel(db.Model):
     __tablename__ = "book_feedback"
     uid = Column(Integer, ForeignKey("user_login.id"), primary_key=True)
-    book_id = Column(Integer, ForeignKey("book.id"), primary_key=True)
+    book_id = Column(Integer, ForeignKey("book.id"), primary_key=True, index=True)
     feedback = Column(String(500), nullable=False)
     rating = Column(Integer, nullable=False)
 
 class BuyHistoryModel(db.Model):
     __tablename__ = "buy_history"
-    uid = Column(Integer, ForeignKey("user_login.id"), primary_key=True)
-    book_id = Column(Integer, ForeignKey("book.id"),  primary_key=True)
-    bought_at = Column(DateTime, nullable=False)
\ No newline at end of file
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    uid = Column(Integer, ForeignKey("user_login.id"), nullable=False)
+    book_id = Column(Integer, ForeignKey("book.id"), nullable=False)
+    bought_at = Column(DateTime, nullable=False, index=True)
+    # The book's price when it was bought
+    price = Column(Integer, nullable=False)
+
+    __table_args__ = (UniqueConstraint(uid, book_id),)
+
+class DailyBookRevenueModel(db.Model):
+    # Kept up to date from buy_history by the triggers in purchases.py
+    __tablename__ = "daily_book_revenue"
+    day = Column(Date, primary_key=True)
+    book_id = Column(Integer, ForeignKey("book.id"), primary_key=True, index=True)
+    purchase_count = Column(Integer, nullable=False, default=0)
+    revenue = Column(Integer, nullable=False, default=0)
+
+class DailyUserSpendModel(db.Model):
+    # Kept up to date from buy_history by the triggers in purchases.py
+    __tablename__ = "daily_user_spend"
+    day = Column(Date, primary_key=True)
+    uid = Column(Integer, ForeignKey("user_login.id"), primary_key=True, index=True)
+    purchase_count = Column(Integer, nullable=False, default=0)
+    spend = Column(Integer, nullable=False, default=0)
+
+class BookTextModel(db.Model):
+    __tablename__ = "book_text"
+    content = Column(String, primary_key=True)
+    page_count = Column(Integer, nullable=False)
+
+class BlobClaimModel(db.Model):
+    # A stored PDF no book refers to yet; see blobstore.py
+    __tablename__ = "blob_claim"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    content = Column(String, nullable=False, index=True)
+    claimed_at = Column(DateTime, nullable=False)
+
+class BookRatingModel(db.Model):
+    # One row per book, kept up to date from book and book_feedback by the
+    # triggers in ratings.py
+    __tablename__ = "book_rating"
+    book_id = Column(Integer, ForeignKey("book.id"), primary_key=True)
+    rating_count = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    average_rating = Column(Float)
+    rating_0 = Column(Integer, nullable=False, default=0)
+    rating_1 = Column(Integer, nullable=False, default=0)
+    rating_2 = Column(Integer, nullable=False, default=0)
+    rating_3 = Column(Integer, nullable=False, default=0)
+    rating_4 = Column(Integer, nullable=False, default=0)
+    rating_5 = Column(Integer, nullable=False, default=0)
+    rating_6 = Column(Integer, nullable=False, default=0)
+    rating_7 = Column(Integer, nullable=False, default=0)
+    rating_8 = Column(Integer, nullable=False, default=0)
+    rating_9 = Column(Integer, nullable=False, default=0)
+    rating_10 = Column(Integer, nullable=False, default=0)
+
+    # The ?sort=rating order, see ratings.rating_order
+    __table_args__ = (
+        Index("ix_book_rating_rank", func.coalesce(average_rating, literal_column("-1"))),
+    )
@@ -0,0 +1,208 @@
+import re
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from sqlalchemy import column, func, literal_column, table, text
+from typing import List, Optional
+from blobstore import blob_path
+from models import db, BookModel, BookTextModel
+
+# The text of every page of every stored PDF, one row per page. Rows are keyed
+# by the blob digest, so books sharing a PDF share its pages, and book_text
+# records which digests have been extracted. Extraction uses pypdf when it is
+# installed, otherwise poppler's pdftotext.
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+pdftotext = shutil.which("pdftotext")
+
+extract_timeout = 300
+
+book_pages = table(
+    "book_pages",
+    column("rowid"),
+    column("body"),
+    column("content"),
+    column("page"),
+)
+
+# Drop a PDF's pages once the last book using it is gone
+forget_pages_sql = """
+    DELETE FROM book_pages WHERE content = OLD.content;
+    DELETE FROM book_text WHERE content = OLD.content;
+"""
+
+page_index_ddl = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS book_pages USING fts5(
+        body, content UNINDEXED, page UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS book_pages_book_delete AFTER DELETE ON book
+    WHEN NOT EXISTS (SELECT 1 FROM book WHERE content = OLD.content) BEGIN
+        {forget_pages_sql}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS book_pages_book_update AFTER UPDATE OF content ON book
+    WHEN OLD.content != NEW.content
+        AND NOT EXISTS (SELECT 1 FROM book WHERE content = OLD.content) BEGIN
+        {forget_pages_sql}
+    END
+    """,
+]
+
+_executor = None
+
+
+def create_page_index():
+    for statement in page_index_ddl:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+def text_extraction_enabled() -> bool:
+    return pypdf is not None or pdftotext is not None
+
+
+def extract_pages(pdf_path: str) -> List[str]:
+    """Text of each page of a PDF. Runs in the worker processes."""
+    if pypdf is not None:
+        return [page.extract_text() or "" for page in pypdf.PdfReader(pdf_path).pages]
+
+    output = subprocess.run(
+        [pdftotext, "-enc", "UTF-8", pdf_path, "-"],
+        check=True,
+        capture_output=True,
+        timeout=extract_timeout,
+    ).stdout.decode("utf-8", errors="replace")
+
+    # Every page ends with a form feed, including the last one
+    pages = output.split("\f")
+    if pages and not pages[-1].strip():
+        pages.pop()
+    return pages
+
+
+def store_pages(content: str, pages: List[str]):
+    """Replace content's rows in the page index."""
+    if not BookModel.query.filter_by(content=content).first():
+        # The book went away while its text was being extracted
+        return
+
+    db.session.execute(book_pages.delete().where(book_pages.c.content == content))
+    if pages:
+        db.session.execute(
+            book_pages.insert(),
+            [
+                {"body": body, "content": content, "page": page}
+                for page, body in enumerate(pages, start=1)
+            ],
+        )
+    db.session.merge(BookTextModel(content=content, page_count=len(pages)))
+    db.session.commit()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=current_app.config["TEXT_EXTRACT_WORKERS"]
+        )
+    return _executor
+
+
+def schedule_page_extraction(content: str):
+    """Extract content's page text in the worker pool and index it when done.
+
+    Returns at once; the index is written from the pool's callback thread.
+    """
+    if not text_extraction_enabled():
+        return None
+
+    app = current_app._get_current_object()  # type: ignore
+    future = get_executor().submit(extract_pages, blob_path(content))
+
+    def index_pages(done):
+        try:
+            pages = done.result()
+        except Exception as e:
+            app.logger.warning("Could not extract text of %s: %s", content, e)
+            return
+
+        with app.app_context():
+            store_pages(content, pages)
+
+    future.add_done_callback(index_pages)
+    return future
+
+
+def index_missing_pages() -> int:
+    """Extract and index every stored PDF that is not in the page index yet."""
+    if not text_extraction_enabled():
+        return 0
+
+    contents = [
+        content
+        for (content,) in db.session.query(BookModel.content)
+        .outerjoin(BookTextModel, BookTextModel.content == BookModel.content)
+        .filter(BookTextModel.content.is_(None))
+        .distinct()
+    ]
+    futures = [
+        (content, get_executor().submit(extract_pages, blob_path(content)))
+        for content in contents
+    ]
+
+    indexed = 0
+    for content, future in futures:
+        try:
+            pages = future.result()
+        except Exception as e:
+            current_app.logger.warning("Could not extract text of %s: %s", content, e)
+            continue
+        store_pages(content, pages)
+        indexed += 1
+    return indexed
+
+
+def page_match(search_word: str) -> Optional[str]:
+    """FTS query matching pages that contain every word of search_word."""
+    words = re.findall(r"\w+", search_word)
+    if not words:
+        return None
+    return " ".join('"' + word + '"' for word in words)
+
+
+def search_pages(search_word: str, limit: int, filter_section=None):
+    """Best matching pages for search_word, with the book they belong to.
+
+    Each row has book_id, name, page and a short snippet of the page around
+    the match, best matches first.
+    """
+    match = page_match(search_word)
+    if match is None:
+        return []
+
+    index = literal_column("book_pages")
+    query = (
+        db.session.query(book_pages)
+        .join(BookModel, onclause=BookModel.content == book_pages.c.content)
+        .with_entities(
+            BookModel.id.label("book_id"),
+            BookModel.name,
+            book_pages.c.page,
+            func.snippet(index, 0, "[", "]", "...", 12).label("snippet"),
+        )
+        .filter(index.op("MATCH")(match))
+    )
+
+    if filter_section:
+        query = query.filter(BookModel.section_id == filter_section)
+
+    return query.order_by(func.bm25(index), BookModel.id).limit(limit).all()
@@ -0,0 +1,129 @@
+import operator
+from flask import request, url_for
+from sqlalchemy import and_, tuple_
+from typing import Callable, List, NamedTuple, Optional
+
+default_page_size = 20
+max_page_size = 100
+
+
+class Page(NamedTuple):
+    items: list
+    next_after: Optional[int]
+    prev_before: Optional[int]
+
+
+def page_args():
+    """(limit, after, before) from the query string, with limit clamped."""
+    limit = request.args.get("limit", default=default_page_size, type=int)
+    after = request.args.get("after", default=None, type=int)
+    before = request.args.get("before", default=None, type=int)
+    return max(1, min(limit, max_page_size)), after, before
+
+
+def keyset_page(
+    query,
+    keys: List,
+    after_keys=None,
+    before_keys=None,
+    limit: int = default_page_size,
+    cursor_of: Callable = lambda row: row.id,
+    descending: bool = False,
+) -> Page:
+    """One page of query ordered by keys, starting after or ending before a cursor.
+
+    after_keys and before_keys are the key values of the cursor row, in the
+    same order as keys. descending orders by every key descending. Nothing is
+    skipped with OFFSET, so a page costs the same wherever it is in the result.
+    """
+
+    def beyond(values, later: bool):
+        """Rows coming after (later) or before the cursor row in page order."""
+        if later != descending:
+            return compare(values, operator.gt, operator.ge)
+        return compare(values, operator.lt, operator.le)
+
+    def compare(values, strictly, leading):
+        if len(keys) == 1:
+            return strictly(keys[0], values[0])
+        # SQLite won't seek an index with a row value compare on an
+        # expression key, but will with the bound on the leading key
+        return and_(leading(keys[0], values[0]), strictly(tuple_(*keys), tuple_(*values)))
+
+    forward = [k.desc() for k in keys] if descending else keys
+    backward = keys if descending else [k.desc() for k in keys]
+
+    if before_keys is not None:
+        rows = (
+            query.filter(beyond(before_keys, later=False))
+            .order_by(*backward)
+            .limit(limit + 1)
+            .all()
+        )
+        has_previous = len(rows) > limit
+        rows = rows[:limit][::-1]
+        return Page(
+            items=rows,
+            next_after=cursor_of(rows[-1]) if rows else None,
+            prev_before=cursor_of(rows[0]) if rows and has_previous else None,
+        )
+
+    if after_keys is not None:
+        query = query.filter(beyond(after_keys, later=True))
+
+    rows = query.order_by(*forward).limit(limit + 1).all()
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    return Page(
+        items=rows,
+        next_after=cursor_of(rows[-1]) if rows and has_next else None,
+        prev_before=cursor_of(rows[0]) if rows and after_keys is not None else None,
+    )
+
+
+def id_page(
+    query,
+    key,
+    after=None,
+    before=None,
+    limit: int = default_page_size,
+    cursor_of: Callable = lambda row: row.id,
+) -> Page:
+    """keyset_page on a single id column, with after and before as plain ids."""
+    return keyset_page(
+        query,
+        [key],
+        after_keys=None if after is None else (after,),
+        before_keys=None if before is None else (before,),
+        limit=limit,
+        cursor_of=cursor_of,
+    )
+
+
+def page_url(**cursor) -> str:
+    args = request.args.to_dict()
+    args.pop("after", None)
+    args.pop("before", None)
+    args.update(cursor)
+    return url_for(request.endpoint, **(request.view_args or {}), **args)  # type: ignore
+
+
+def page_links(page: Page):
+    """(prev_url, next_url) for page on the current endpoint, None where there is no such page."""
+    prev_url = None
+    next_url = None
+    if page.prev_before is not None:
+        prev_url = page_url(before=page.prev_before)
+    if page.next_after is not None:
+        next_url = page_url(after=page.next_after)
+    return prev_url, next_url
+
+
+def link_header(page: Page) -> dict:
+    prev_url, next_url = page_links(page)
+    links = []
+    if prev_url:
+        links.append(f'<{prev_url}>; rel="prev"')
+    if next_url:
+        links.append(f'<{next_url}>; rel="next"')
+    return {"Link": ", ".join(links)} if links else {}
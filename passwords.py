@@ -0,0 +1,175 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from flask import current_app
+from typing import Dict, List
+from werkzeug.security import check_password_hash, generate_password_hash
+from models import db, UserLoginModel
+
+# Hashes are werkzeug's "method$salt$hash" strings. PASSWORD_HASH_METHOD sets
+# the method and its work factor, e.g. "pbkdf2:sha256:600000" or
+# "scrypt:32768:8:1"; rows hashed another way, or still in plaintext from
+# before hashing, are rehashed the next time their user logs in.
+hash_prefixes = ("pbkdf2:", "scrypt:")
+
+default_hash_method = "pbkdf2:sha256:600000"
+
+benchmark_methods = [
+    "pbkdf2:sha256:100000",
+    "pbkdf2:sha256:300000",
+    "pbkdf2:sha256:600000",
+    "pbkdf2:sha256:1000000",
+    "scrypt:16384:8:1",
+    "scrypt:32768:8:1",
+]
+
+_executor = None
+_slots = None
+_executor_lock = threading.Lock()
+
+_login_cache: Dict[bytes, float] = {}
+_login_cache_lock = threading.Lock()
+login_cache_size = 1024
+
+
+class LoginBusy(Exception):
+    """Every password hashing slot is taken, or the hash waited too long; the caller should answer 503."""
+
+
+def hash_method() -> str:
+    return current_app.config.get("PASSWORD_HASH_METHOD", default_hash_method)
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith(hash_prefixes) and stored.count("$") == 2
+
+
+def needs_rehash(stored: str) -> bool:
+    return not is_hashed(stored) or stored.split("$", 1)[0] != hash_method()
+
+
+def hash_password(password: str) -> str:
+    return run_kdf(generate_password_hash, password, hash_method())
+
+
+def get_executor():
+    """The hashing pool and the semaphore bounding the work queued on it.
+
+    PASSWORD_HASH_WORKERS threads hash at once and up to PASSWORD_HASH_QUEUE
+    more wait; past that, run_kdf refuses instead of piling up requests.
+    """
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            workers = current_app.config.get("PASSWORD_HASH_WORKERS") or os.cpu_count() or 1
+            queue = current_app.config.get("PASSWORD_HASH_QUEUE", 16)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kdf")
+            _slots = threading.BoundedSemaphore(workers + queue)
+    return _executor, _slots
+
+
+def run_kdf(function, *args):
+    """Run a hashing function on the bounded pool and wait for its result.
+
+    hashlib releases the GIL while hashing, so the pool caps how many cores
+    logins take at once. The calling request worker still blocks until the
+    hash is done, so a burst of logins holds workers for up to
+    PASSWORD_HASH_TIMEOUT seconds each. Raises LoginBusy when the pool is
+    full, or when the hash is not done in time; a hash that has not started
+    by then is cancelled.
+    """
+    executor, slots = get_executor()
+    if not slots.acquire(blocking=False):
+        raise LoginBusy()
+    try:
+        future = executor.submit(function, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda done: slots.release())
+    try:
+        return future.result(timeout=current_app.config.get("PASSWORD_HASH_TIMEOUT"))
+    except TimeoutError:
+        future.cancel()
+        raise LoginBusy()
+
+
+def login_cache_key(user_login: UserLoginModel, password: str) -> bytes:
+    # Keyed on the stored hash too, so a changed password misses the cache
+    message = f"{user_login.id}\0{user_login.password}\0{password}".encode()
+    return hmac.new(current_app.config["SECRET_KEY"].encode(), message, hashlib.sha256).digest()
+
+
+def recently_verified(key: bytes) -> bool:
+    with _login_cache_lock:
+        expires_at = _login_cache.get(key)
+        return expires_at is not None and expires_at > time.monotonic()
+
+
+def remember_login(key: bytes):
+    ttl = current_app.config.get("LOGIN_CACHE_TTL", 0)
+    if not ttl:
+        return
+    now = time.monotonic()
+    with _login_cache_lock:
+        if len(_login_cache) >= login_cache_size:
+            for cached_key, expires_at in list(_login_cache.items()):
+                if expires_at <= now:
+                    del _login_cache[cached_key]
+            if len(_login_cache) >= login_cache_size:
+                _login_cache.clear()
+        _login_cache[key] = now + ttl
+
+
+def check_stored_password(stored: str, password: str) -> bool:
+    if is_hashed(stored):
+        return check_password_hash(stored, password)
+    return hmac.compare_digest(stored.encode(), password.encode())
+
+
+def verify_password(user_login: UserLoginModel, password) -> bool:
+    """Check a login's password, rehashing legacy or outdated hashes on success.
+
+    A successful check is remembered for LOGIN_CACHE_TTL seconds, so repeated
+    logins with the same credentials skip the KDF. Raises LoginBusy when the
+    hashing pool is full.
+    """
+    if not password:
+        return False
+
+    key = login_cache_key(user_login, password)
+    if recently_verified(key):
+        return True
+
+    if not run_kdf(check_stored_password, user_login.password, password):
+        return False
+
+    if needs_rehash(user_login.password):
+        user_login.password = hash_password(password)
+        db.session.commit()
+        key = login_cache_key(user_login, password)
+
+    remember_login(key)
+    return True
+
+
+def benchmark_kdf(methods: List[str], rounds: int) -> List[dict]:
+    """Time rounds password checks per hash method on one thread."""
+    results = []
+    for method in methods:
+        stored = generate_password_hash("benchmark password", method)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            check_password_hash(stored, "benchmark password")
+        seconds = (time.perf_counter() - started) / rounds
+        results.append(
+            {
+                "method": method,
+                "ms_per_login": seconds * 1000,
+                "logins_per_second_per_core": 1 / seconds,
+            }
+        )
+    return results
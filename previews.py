@@ -0,0 +1,115 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from flask import current_app
+from typing import Optional
+from blobstore import blob_path, content_version
+
+# First page thumbnails live in <UPLOAD_FOLDER>/previews/<content version>.png.
+# They are rendered with PyMuPDF when it is installed, otherwise with poppler's
+# pdftoppm, and not at all when neither is available.
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+pdftoppm = shutil.which("pdftoppm")
+
+render_timeout = 60
+
+
+def previews_enabled() -> bool:
+    return fitz is not None or pdftoppm is not None
+
+
+def preview_root() -> str:
+    return os.path.join(current_app.config["UPLOAD_FOLDER"], "previews")
+
+
+def preview_path(content: str) -> str:
+    return os.path.join(preview_root(), content_version(content) + ".png")
+
+
+def render_first_page(pdf_path: str, png_path: str, width: int):
+    if fitz is not None:
+        with fitz.open(pdf_path) as document:
+            page = document[0]
+            zoom = width / page.rect.width
+            page.get_pixmap(matrix=fitz.Matrix(zoom, zoom)).save(png_path)
+        return
+
+    # pdftoppm appends the extension itself
+    subprocess.run(
+        [
+            pdftoppm,
+            "-png",
+            "-singlefile",
+            "-f", "1",
+            "-l", "1",
+            "-scale-to-x", str(width),
+            "-scale-to-y", "-1",
+            pdf_path,
+            png_path[: -len(".png")],
+        ],
+        check=True,
+        capture_output=True,
+        timeout=render_timeout,
+    )
+
+
+def ensure_preview(content: str) -> Optional[str]:
+    """Path of the thumbnail of content's first page, rendering it on a cache miss.
+
+    Returns None when no renderer is available or the PDF is missing or
+    can't be rendered.
+    """
+    path = preview_path(content)
+    if os.path.exists(path):
+        # The modification time doubles as the last use for trim_preview_cache
+        os.utime(path)
+        return path
+
+    if not previews_enabled() or not os.path.exists(blob_path(content)):
+        return None
+
+    os.makedirs(preview_root(), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(suffix=".png", dir=preview_root())
+    os.close(fd)
+    try:
+        render_first_page(
+            blob_path(content), temp_path, current_app.config["PREVIEW_WIDTH"]
+        )
+        os.replace(temp_path, path)
+    except Exception as e:
+        current_app.logger.warning("Could not render preview of %s: %s", content, e)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+
+    trim_preview_cache()
+    return path
+
+
+def trim_preview_cache() -> int:
+    """Remove the least recently used thumbnails until the cache fits PREVIEW_CACHE_SIZE."""
+    root = preview_root()
+    if not os.path.isdir(root):
+        return 0
+
+    entries = sorted(
+        (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+        for entry in os.scandir(root)
+        if entry.is_file()
+    )
+    total = sum(size for _, size, _ in entries)
+    max_size = current_app.config["PREVIEW_CACHE_SIZE"]
+
+    removed = 0
+    for _, size, path in entries:
+        if total <= max_size:
+            break
+        os.remove(path)
+        total -= size
+        removed += 1
+    return removed
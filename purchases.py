@@ -0,0 +1,265 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.sqlite import insert
+from typing import List, Optional
+from models import (
+    db,
+    BookModel,
+    BuyHistoryModel,
+    DailyBookRevenueModel,
+    DailyUserSpendModel,
+)
+from pagination import Page, default_page_size, keyset_page
+
+# daily_book_revenue and daily_user_spend hold the purchases and money taken
+# per book and per user for each day, so reports read one row per book or
+# user per day instead of all of buy_history. A purchase is counted at the
+# price stored with it, the book's price when it was bought.
+
+
+def summary_change(row: str, sign: str) -> List[str]:
+    price = f"{row}.price"
+    # Not INSERT OR IGNORE: an outer statement's conflict handling would override it
+    return [
+        f"""
+        INSERT INTO daily_book_revenue (day, book_id, purchase_count, revenue)
+        SELECT date({row}.bought_at), {row}.book_id, 0, 0
+        WHERE NOT EXISTS (
+            SELECT 1 FROM daily_book_revenue
+            WHERE day = date({row}.bought_at) AND book_id = {row}.book_id
+        );
+        UPDATE daily_book_revenue
+        SET purchase_count = purchase_count {sign} 1, revenue = revenue {sign} {price}
+        WHERE day = date({row}.bought_at) AND book_id = {row}.book_id;
+        """,
+        f"""
+        INSERT INTO daily_user_spend (day, uid, purchase_count, spend)
+        SELECT date({row}.bought_at), {row}.uid, 0, 0
+        WHERE NOT EXISTS (
+            SELECT 1 FROM daily_user_spend
+            WHERE day = date({row}.bought_at) AND uid = {row}.uid
+        );
+        UPDATE daily_user_spend
+        SET purchase_count = purchase_count {sign} 1, spend = spend {sign} {price}
+        WHERE day = date({row}.bought_at) AND uid = {row}.uid;
+        """,
+    ]
+
+
+summary_triggers = ["purchase_summary_insert", "purchase_summary_delete"]
+
+summary_ddl = [
+    f"""
+    CREATE TRIGGER purchase_summary_insert AFTER INSERT ON buy_history BEGIN
+        {"".join(summary_change("NEW", "+"))}
+    END
+    """,
+    f"""
+    CREATE TRIGGER purchase_summary_delete AFTER DELETE ON buy_history BEGIN
+        {"".join(summary_change("OLD", "-"))}
+    END
+    """,
+]
+
+
+def create_purchase_summaries():
+    """Create the triggers maintaining the daily summaries, filling them on first creation."""
+    exists = db.session.execute(
+        text(
+            "SELECT 1 FROM sqlite_master "
+            "WHERE type = 'trigger' AND name = 'purchase_summary_insert'"
+        )
+    ).first()
+
+    for name in summary_triggers:
+        db.session.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    for statement in summary_ddl:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+    if not exists:
+        rebuild_purchase_summaries()
+
+
+def rebuild_purchase_summaries() -> int:
+    """Recompute both daily summaries from buy_history, at the prices paid."""
+    db.session.execute(text("DELETE FROM daily_book_revenue"))
+    db.session.execute(text("DELETE FROM daily_user_spend"))
+    db.session.execute(
+        text(
+            """
+            INSERT INTO daily_book_revenue (day, book_id, purchase_count, revenue)
+            SELECT date(bought_at), book_id, COUNT(*), SUM(price)
+            FROM buy_history GROUP BY date(bought_at), book_id
+            """
+        )
+    )
+    db.session.execute(
+        text(
+            """
+            INSERT INTO daily_user_spend (day, uid, purchase_count, spend)
+            SELECT date(bought_at), uid, COUNT(*), SUM(price)
+            FROM buy_history GROUP BY date(bought_at), uid
+            """
+        )
+    )
+    db.session.commit()
+    return db.session.query(BuyHistoryModel).count()
+
+
+def record_purchase(uid: int, book_id: int, price: int) -> bool:
+    """Add a purchase at price, returning False if uid had already bought the book."""
+    result = db.session.execute(
+        insert(BuyHistoryModel)
+        .values(uid=uid, book_id=book_id, bought_at=datetime.now(), price=price)
+        .on_conflict_do_nothing()
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def purchases_query(uid=None, book_id=None, since: Optional[date] = None, until: Optional[date] = None):
+    """Purchases with their book's details, bought between since and until inclusive."""
+    query = (
+        db.session.query(BuyHistoryModel)
+        .outerjoin(BookModel, onclause=BookModel.id == BuyHistoryModel.book_id)
+        .with_entities(
+            BuyHistoryModel.id,
+            BuyHistoryModel.uid,
+            BuyHistoryModel.book_id,
+            BuyHistoryModel.bought_at,
+            BuyHistoryModel.price,
+            BookModel.isbn,
+            BookModel.name,
+        )
+    )
+    if uid is not None:
+        query = query.filter(BuyHistoryModel.uid == uid)
+    if book_id is not None:
+        query = query.filter(BuyHistoryModel.book_id == book_id)
+    if since is not None:
+        query = query.filter(BuyHistoryModel.bought_at >= datetime.combine(since, datetime.min.time()))
+    if until is not None:
+        query = query.filter(
+            BuyHistoryModel.bought_at < datetime.combine(until + timedelta(days=1), datetime.min.time())
+        )
+    return query
+
+
+def purchases_page(query, after=None, before=None, limit: int = default_page_size) -> Page:
+    """One page of purchases_query, oldest first, keyed on (bought_at, id).
+
+    after and before are purchase ids; the cursor's bought_at is looked up,
+    so callers only pass ids around.
+    """
+
+    def cursor_keys(purchase_id):
+        if purchase_id is None:
+            return None
+        bought_at = (
+            select(BuyHistoryModel.bought_at)
+            .where(BuyHistoryModel.id == purchase_id)
+            .scalar_subquery()
+        )
+        return (bought_at, purchase_id)
+
+    return keyset_page(
+        query,
+        [BuyHistoryModel.bought_at, BuyHistoryModel.id],
+        after_keys=cursor_keys(after),
+        before_keys=cursor_keys(before),
+        limit=limit,
+    )
+
+
+def purchase_json(purchase) -> dict:
+    return {
+        "id": purchase.id,
+        "uid": purchase.uid,
+        "book_id": purchase.book_id,
+        "isbn": purchase.isbn,
+        "name": purchase.name,
+        "price": purchase.price,
+        "bought_at": purchase.bought_at.isoformat(),
+    }
+
+
+def in_days(query, model, since: Optional[date], until: Optional[date]):
+    if since is not None:
+        query = query.filter(model.day >= since)
+    if until is not None:
+        query = query.filter(model.day <= until)
+    return query
+
+
+def revenue_by_book(since: Optional[date] = None, until: Optional[date] = None) -> List[dict]:
+    rows = in_days(
+        db.session.query(DailyBookRevenueModel)
+        .outerjoin(BookModel, onclause=BookModel.id == DailyBookRevenueModel.book_id)
+        .group_by(DailyBookRevenueModel.book_id)
+        .with_entities(
+            DailyBookRevenueModel.book_id,
+            BookModel.isbn,
+            BookModel.name,
+            func.sum(DailyBookRevenueModel.purchase_count).label("purchase_count"),
+            func.sum(DailyBookRevenueModel.revenue).label("revenue"),
+        ),
+        DailyBookRevenueModel,
+        since,
+        until,
+    )
+    return [
+        {
+            "book_id": row.book_id,
+            "isbn": row.isbn,
+            "name": row.name,
+            "purchase_count": row.purchase_count,
+            "revenue": row.revenue,
+        }
+        for row in rows.order_by(func.sum(DailyBookRevenueModel.revenue).desc())
+    ]
+
+
+def spend_by_user(since: Optional[date] = None, until: Optional[date] = None) -> List[dict]:
+    rows = in_days(
+        db.session.query(DailyUserSpendModel)
+        .group_by(DailyUserSpendModel.uid)
+        .with_entities(
+            DailyUserSpendModel.uid,
+            func.sum(DailyUserSpendModel.purchase_count).label("purchase_count"),
+            func.sum(DailyUserSpendModel.spend).label("spend"),
+        ),
+        DailyUserSpendModel,
+        since,
+        until,
+    )
+    return [
+        {"uid": row.uid, "purchase_count": row.purchase_count, "spend": row.spend}
+        for row in rows.order_by(func.sum(DailyUserSpendModel.spend).desc())
+    ]
+
+
+def revenue_by_day(since: Optional[date] = None, until: Optional[date] = None) -> List[dict]:
+    rows = in_days(
+        db.session.query(DailyBookRevenueModel)
+        .group_by(DailyBookRevenueModel.day)
+        .with_entities(
+            DailyBookRevenueModel.day,
+            func.sum(DailyBookRevenueModel.purchase_count).label("purchase_count"),
+            func.sum(DailyBookRevenueModel.revenue).label("revenue"),
+        ),
+        DailyBookRevenueModel,
+        since,
+        until,
+    )
+    return [
+        {"day": row.day.isoformat(), "purchase_count": row.purchase_count, "revenue": row.revenue}
+        for row in rows.order_by(DailyBookRevenueModel.day)
+    ]
+
+
+purchase_reports = {
+    "book": revenue_by_book,
+    "user": spend_by_user,
+    "day": revenue_by_day,
+}
@@ -0,0 +1,188 @@
+from sqlalchemy import func, literal_column, select, text
+from typing import Optional
+from book_feedback import rating_values
+from models import db, BookRatingModel
+
+# book_rating holds the count, sum, average and a histogram of the ratings
+# (0 to 10) of each book, and the triggers below keep it in step with
+# book_feedback inside the same transaction as the feedback write. Every book
+# has a row, unrated ones with a NULL average, so ?sort=rating can read the
+# catalogue straight off the ix_book_rating_rank index.
+
+histogram_columns = [f"rating_{value}" for value in rating_values]
+
+
+def rating_change(row: str, sign: str) -> str:
+    """SET clause adding (sign "+") or removing (sign "-") row's rating."""
+    return ", ".join(
+        [
+            f"rating_count = rating_count {sign} 1",
+            f"rating_sum = rating_sum {sign} {row}.rating",
+        ]
+        + [
+            f"{column} = {column} {sign} ({row}.rating = {value})"
+            for column, value in zip(histogram_columns, rating_values)
+        ]
+    )
+
+
+def unrated_sql(book_id: str) -> str:
+    """Statement adding an empty book_rating row for book_id unless it has one."""
+    zeros = ", ".join("0" for _ in histogram_columns)
+    # Not INSERT OR IGNORE: an outer upsert's conflict handling would override it
+    return f"""
+        INSERT INTO book_rating (book_id, rating_count, rating_sum, {", ".join(histogram_columns)})
+        SELECT {book_id}, 0, 0, {zeros}
+        WHERE NOT EXISTS (SELECT 1 FROM book_rating WHERE book_id = {book_id});
+    """
+
+
+def add_rating_sql(row: str) -> str:
+    return f"""
+        {unrated_sql(f"{row}.book_id")}
+        UPDATE book_rating SET {rating_change(row, "+")} WHERE book_id = {row}.book_id;
+        UPDATE book_rating SET average_rating = rating_sum * 1.0 / rating_count
+        WHERE book_id = {row}.book_id;
+    """
+
+
+def remove_rating_sql(row: str) -> str:
+    return f"""
+        UPDATE book_rating SET {rating_change(row, "-")} WHERE book_id = {row}.book_id;
+        UPDATE book_rating SET average_rating = rating_sum * 1.0 / NULLIF(rating_count, 0)
+        WHERE book_id = {row}.book_id;
+    """
+
+
+rating_triggers = [
+    "book_rating_book_insert",
+    "book_rating_feedback_insert",
+    "book_rating_feedback_delete",
+    "book_rating_feedback_update",
+    "book_rating_book_delete",
+]
+
+rating_ddl = [
+    f"""
+    CREATE TRIGGER book_rating_book_insert AFTER INSERT ON book BEGIN
+        {unrated_sql("NEW.id")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER book_rating_feedback_insert AFTER INSERT ON book_feedback BEGIN
+        {add_rating_sql("NEW")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER book_rating_feedback_delete AFTER DELETE ON book_feedback BEGIN
+        {remove_rating_sql("OLD")}
+    END
+    """,
+    f"""
+    CREATE TRIGGER book_rating_feedback_update
+    AFTER UPDATE OF book_id, rating ON book_feedback BEGIN
+        {remove_rating_sql("OLD")}
+        {add_rating_sql("NEW")}
+    END
+    """,
+    """
+    CREATE TRIGGER book_rating_book_delete AFTER DELETE ON book BEGIN
+        DELETE FROM book_rating WHERE book_id = OLD.id;
+    END
+    """,
+]
+
+
+def create_rating_index():
+    """Create the triggers maintaining book_rating, filling the table on first creation."""
+    exists = db.session.execute(
+        text(
+            "SELECT 1 FROM sqlite_master "
+            "WHERE type = 'trigger' AND name = 'book_rating_feedback_insert'"
+        )
+    ).first()
+
+    # Recreated every start so existing databases pick up changes to the trigger bodies
+    for name in rating_triggers:
+        db.session.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    for statement in rating_ddl:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+    if not exists:
+        rebuild_ratings()
+        return
+
+    # Books added before book_rating_book_insert existed
+    zeros = ", ".join("0" for _ in histogram_columns)
+    db.session.execute(
+        text(
+            f"""
+            INSERT INTO book_rating (book_id, rating_count, rating_sum, {", ".join(histogram_columns)})
+            SELECT id, 0, 0, {zeros} FROM book
+            WHERE NOT EXISTS (SELECT 1 FROM book_rating WHERE book_id = book.id)
+            """
+        )
+    )
+    db.session.commit()
+
+
+def rebuild_ratings() -> int:
+    """Recompute book_rating for every book from book_feedback with one grouped pass."""
+    histogram = ", ".join(
+        f"COALESCE(SUM(book_feedback.rating = {value}), 0)" for value in rating_values
+    )
+    db.session.execute(text("DELETE FROM book_rating"))
+    result = db.session.execute(
+        text(
+            f"""
+            INSERT INTO book_rating (
+                book_id, rating_count, rating_sum, average_rating, {", ".join(histogram_columns)}
+            )
+            SELECT book.id, COUNT(book_feedback.rating), COALESCE(SUM(book_feedback.rating), 0),
+                AVG(book_feedback.rating), {histogram}
+            FROM book LEFT JOIN book_feedback ON book_feedback.book_id = book.id
+            GROUP BY book.id
+            """
+        )
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def rating_json(rating: Optional[BookRatingModel]) -> dict:
+    if rating is None or not rating.rating_count:
+        return {
+            "rating_count": 0,
+            "average_rating": None,
+            "histogram": {str(value): 0 for value in rating_values},
+        }
+
+    return {
+        "rating_count": rating.rating_count,
+        "average_rating": rating.average_rating,
+        "histogram": {
+            str(value): getattr(rating, column)
+            for column, value in zip(histogram_columns, rating_values)
+        },
+    }
+
+
+def get_book_rating(book_id) -> Optional[BookRatingModel]:
+    return db.session.get(BookRatingModel, book_id)
+
+
+def rating_order():
+    """Sort key of the best rated books, with unrated ones at -1; sort on it descending.
+
+    Spelled exactly like ix_book_rating_rank, so SQLite reads the order off
+    the index instead of sorting.
+    """
+    return func.coalesce(BookRatingModel.average_rating, literal_column("-1"))
+
+
+def rating_cursor_keys(book_id):
+    if book_id is None:
+        return None
+    rating = select(rating_order()).where(BookRatingModel.book_id == book_id).scalar_subquery()
+    return (rating, book_id)
@@ -0,0 +1,227 @@
+from sqlalchemy import case, column, func, literal_column, or_, select, table, text
+from models import db, BookModel, SectionModel
+from pagination import Page, default_page_size, id_page, keyset_page
+
+# One row per book (rowid = book.id) holding the search words of the book, its
+# authors and its section. The trigram tokenizer gives the same substring
+# semantics as the old LIKE '%word%' queries, but answered from the index.
+book_search = table(
+    "book_search",
+    column("rowid"),
+    column("book_words"),
+    column("author_words"),
+    column("section_words"),
+)
+
+# Trigram queries shorter than this can't use the index
+min_indexed_length = 3
+
+author_words_sql = (
+    "(SELECT group_concat(search_word, ' ') FROM book_author WHERE book_id = {book_id})"
+)
+section_words_sql = "(SELECT search_word FROM section WHERE id = {section_id})"
+
+search_index_ddl = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS book_search USING fts5(
+        book_words, author_words, section_words, tokenize = 'trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS book_search_book_insert AFTER INSERT ON book BEGIN
+        INSERT INTO book_search (rowid, book_words, author_words, section_words)
+        VALUES (
+            NEW.id,
+            NEW.search_word,
+            {author_words_sql.format(book_id="NEW.id")},
+            {section_words_sql.format(section_id="NEW.section_id")}
+        );
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS book_search_book_update AFTER UPDATE ON book BEGIN
+        DELETE FROM book_search WHERE rowid = OLD.id;
+        INSERT INTO book_search (rowid, book_words, author_words, section_words)
+        VALUES (
+            NEW.id,
+            NEW.search_word,
+            {author_words_sql.format(book_id="NEW.id")},
+            {section_words_sql.format(section_id="NEW.section_id")}
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS book_search_book_delete AFTER DELETE ON book BEGIN
+        DELETE FROM book_search WHERE rowid = OLD.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS book_search_author_insert AFTER INSERT ON book_author BEGIN
+        UPDATE book_search SET author_words = {author_words_sql.format(book_id="NEW.book_id")}
+        WHERE rowid = NEW.book_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS book_search_author_update AFTER UPDATE ON book_author BEGIN
+        UPDATE book_search SET author_words = {author_words_sql.format(book_id="OLD.book_id")}
+        WHERE rowid = OLD.book_id;
+        UPDATE book_search SET author_words = {author_words_sql.format(book_id="NEW.book_id")}
+        WHERE rowid = NEW.book_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS book_search_author_delete AFTER DELETE ON book_author BEGIN
+        UPDATE book_search SET author_words = {author_words_sql.format(book_id="OLD.book_id")}
+        WHERE rowid = OLD.book_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS book_search_section_update AFTER UPDATE OF search_word ON section BEGIN
+        UPDATE book_search SET section_words = NEW.search_word
+        WHERE rowid IN (SELECT id FROM book WHERE section_id = NEW.id);
+    END
+    """,
+]
+
+
+def raw(input: str) -> str:
+    return input.lower().replace(" ", "")
+
+
+def create_search_index():
+    """Create the search table and its sync triggers, backfilling it on first creation."""
+    exists = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'book_search'")
+    ).first()
+
+    for statement in search_index_ddl:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+    if not exists:
+        rebuild_search_index()
+
+
+def rebuild_search_index() -> int:
+    """Repopulate the search table from the book, book_author and section tables."""
+    db.session.execute(text("DELETE FROM book_search"))
+    result = db.session.execute(
+        text(
+            f"""
+            INSERT INTO book_search (rowid, book_words, author_words, section_words)
+            SELECT
+                book.id,
+                book.search_word,
+                {author_words_sql.format(book_id="book.id")},
+                {section_words_sql.format(section_id="book.section_id")}
+            FROM book
+            """
+        )
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def match_source(word: str, index=book_search):
+    """0 for a book match, 1 for an author match, 2 for a section match."""
+    return case(
+        (func.instr(index.c.book_words, word) > 0, 0),
+        (func.instr(index.c.author_words, word) > 0, 1),
+        else_=2,
+    )
+
+
+def search_query(search_word: str, filter_section=None):
+    """Query for the books matching search_word and the match source to order by."""
+    word = raw(search_word)
+
+    query = (
+        db.session.query(book_search)
+        .join(BookModel, onclause=BookModel.id == book_search.c.rowid)
+        .join(SectionModel, onclause=SectionModel.id == BookModel.section_id)
+        .with_entities(
+            BookModel.id,
+            BookModel.isbn,
+            BookModel.name,
+            BookModel.content,
+            BookModel.page_count,
+            BookModel.publisher,
+            BookModel.volume,
+            BookModel.section_id,
+            BookModel.search_word,
+            SectionModel.name.label("section_name"),
+            BookModel.price,
+        )
+    )
+
+    if filter_section:
+        query = query.filter(BookModel.section_id == filter_section)
+
+    if not word:
+        # Everything matches, so every book counts as a book match
+        return query, None
+
+    if len(word) < min_indexed_length:
+        # Too short for a trigram MATCH, still a single pass over the index table
+        like_word = "%" + word + "%"
+        query = query.filter(
+            or_(
+                book_search.c.book_words.like(like_word),
+                book_search.c.author_words.like(like_word),
+                book_search.c.section_words.like(like_word),
+            )
+        )
+    else:
+        match = '"' + word.replace('"', '""') + '"'
+        query = query.filter(literal_column("book_search").op("MATCH")(match))
+
+    return query, word
+
+
+def search_books(search_word: str, filter_section=None):
+    """Books whose own, author or section search words contain search_word.
+
+    Returns one row per book with the book columns plus section_name. Book
+    matches come first, then author matches, then section matches, the same
+    order the separate per-source queries used to produce.
+    """
+    query, word = search_query(search_word, filter_section)
+    if word is None:
+        return query.order_by(BookModel.id).all()
+    return query.order_by(match_source(word), BookModel.id).all()
+
+
+def search_books_page(
+    search_word: str,
+    after=None,
+    before=None,
+    limit: int = default_page_size,
+    filter_section=None,
+) -> Page:
+    """One page of search_books, keyed on (match source, book id).
+
+    after and before are book ids. The cursor book's match source is looked up
+    in the index, so callers only ever pass ids around.
+    """
+    query, word = search_query(search_word, filter_section)
+    if word is None:
+        return id_page(query, BookModel.id, after=after, before=before, limit=limit)
+
+    def cursor_keys(book_id):
+        if book_id is None:
+            return None
+        cursor_row = book_search.alias("cursor_row")
+        source = (
+            select(match_source(word, cursor_row))
+            .where(cursor_row.c.rowid == book_id)
+            .scalar_subquery()
+        )
+        return (source, book_id)
+
+    return keyset_page(
+        query,
+        [match_source(word), BookModel.id],
+        after_keys=cursor_keys(after),
+        before_keys=cursor_keys(before),
+        limit=limit,
+    )
@@ -0,0 +1,92 @@
+import time
+from itertools import chain
+from flask import current_app
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+from expiry import issue_not_expired
+from models import (
+    db,
+    UserInfoModel,
+    SectionModel,
+    BookModel,
+    BookRequestsModel,
+    BookIssueModel,
+)
+
+# Rows added to or removed from these tables change the dashboard counters
+counted_models = (
+    SectionModel,
+    BookModel,
+    BookRequestsModel,
+    BookIssueModel,
+    UserInfoModel,
+)
+
+_cached_stats = None
+_cached_at = 0.0
+
+
+def count_rows(model, *criteria):
+    return select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+
+def get_dashboard_stats() -> dict:
+    """Section, book, request, issue and general user counts in one round trip.
+
+    Results are reused for DASHBOARD_STATS_TTL seconds (0 disables caching), and
+    dropped as soon as a write touches one of the counted tables.
+    """
+    global _cached_stats, _cached_at
+
+    ttl = current_app.config.get("DASHBOARD_STATS_TTL", 0)
+    if ttl and _cached_stats is not None and time.monotonic() - _cached_at < ttl:
+        return _cached_stats
+
+    counts = db.session.execute(
+        select(
+            count_rows(SectionModel).label("section_count"),
+            count_rows(BookModel).label("book_count"),
+            count_rows(BookRequestsModel).label("request_count"),
+            count_rows(BookIssueModel, issue_not_expired()).label("issue_count"),
+            count_rows(UserInfoModel, UserInfoModel.role == "General").label(
+                "general_count"
+            ),
+        )
+    ).one()
+
+    stats = dict(counts._mapping)
+    if ttl:
+        _cached_stats, _cached_at = stats, time.monotonic()
+    return stats
+
+
+def invalidate_dashboard_stats():
+    global _cached_stats
+    _cached_stats = None
+
+
+@event.listens_for(Session, "after_flush")
+def invalidate_on_flush(session, flush_context):
+    if any(
+        isinstance(obj, counted_models) for obj in chain(session.new, session.deleted)
+    ):
+        session.info["dashboard_stats_dirty"] = True
+        invalidate_dashboard_stats()
+
+
+@event.listens_for(Session, "do_orm_execute")
+def invalidate_on_bulk_write(orm_execute_state):
+    # query.delete() and friends skip the flush, so catch them here
+    mapper = orm_execute_state.bind_mapper
+    if (orm_execute_state.is_insert or orm_execute_state.is_delete) and (
+        mapper is not None and mapper.class_ in counted_models
+    ):
+        orm_execute_state.session.info["dashboard_stats_dirty"] = True
+        invalidate_dashboard_stats()
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_on_commit(session):
+    # Drop anything another request cached between our flush and our commit
+    if session.info.pop("dashboard_stats_dirty", False):
+        invalidate_dashboard_stats()
@@ -0,0 +1,38 @@
+import json
+from datetime import date, datetime
+from flask import Response, request, stream_with_context
+from typing import Callable, Iterable, Iterator, Optional
+
+ndjson_mimetype = "application/x-ndjson"
+
+stream_batch_size = 500
+
+
+def json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def ndjson_lines(rows: Iterable[dict]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, default=json_default) + "\n"
+
+
+def ndjson_response(rows: Iterable[dict], headers: Optional[dict] = None) -> Response:
+    """Stream rows as newline-delimited JSON, one object per line, as they are produced."""
+    return Response(
+        stream_with_context(ndjson_lines(rows)),
+        mimetype=ndjson_mimetype,
+        headers=headers,
+    )
+
+
+def stream_requested() -> bool:
+    """True when the client asked for ?stream=1 instead of a JSON list."""
+    return request.args.get("stream", default=0, type=int) == 1
+
+
+def stream_query(query, to_json: Callable, batch_size: int = stream_batch_size) -> Response:
+    """Stream every row of an ORM query as NDJSON, batch_size rows per fetch."""
+    return ndjson_response(to_json(row) for row in query.yield_per(batch_size))
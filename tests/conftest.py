@@ -0,0 +1,136 @@
+import os
+import sys
+import tempfile
+import threading
+import uuid
+from datetime import date
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+# app.py connects and upgrades the database on import, so point it at a
+# scratch database before anything imports it
+scratch_dir = tempfile.mkdtemp(prefix="library-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(scratch_dir, "test.sqlite3")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app  # noqa: E402
+from models import (  # noqa: E402
+    db,
+    BookAuthorModel,
+    BookModel,
+    SectionModel,
+    UserInfoModel,
+    UserLoginModel,
+)
+
+test_password = "password"
+test_hash_method = "pbkdf2:sha256:1000"
+
+
+@pytest.fixture(scope="session")
+def app():
+    flask_app.config.update(
+        TESTING=True,
+        UPLOAD_FOLDER=os.path.join(scratch_dir, "books"),
+        PASSWORD_HASH_METHOD=test_hash_method,
+        LOGIN_CACHE_TTL=0,
+    )
+    return flask_app
+
+
+def in_thread(function, *args, **kwargs):
+    """Run function in a new thread and return its result.
+
+    Requests made from the test thread would share the app context app.py
+    pushes at import, and with it the session and g, between requests.
+    """
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = function(*args, **kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+def unique(prefix: str) -> str:
+    return prefix + uuid.uuid4().hex[:8]
+
+
+@pytest.fixture
+def make_user(app):
+    def make(role: str = "General") -> str:
+        username = unique("user")
+        login = UserLoginModel(
+            username=username, password=generate_password_hash(test_password, test_hash_method)
+        )  # type: ignore
+        db.session.add(login)
+        db.session.flush()
+        db.session.add(UserInfoModel(uid=login.id, first_name="Test", role=role))  # type: ignore
+        db.session.commit()
+        return username
+
+    return make
+
+
+@pytest.fixture
+def login(app):
+    def log_in(username: str):
+        client = app.test_client()
+        response = in_thread(
+            client.post, "/api/login", json={"username": username, "password": test_password}
+        )
+        assert response.status_code == 200, response.get_json()
+        return client
+
+    return log_in
+
+
+@pytest.fixture
+def make_section(app):
+    def make() -> SectionModel:
+        name = unique("s")
+        section = SectionModel(
+            name=name, date_created=date.today(), description="Test", search_word=name
+        )  # type: ignore
+        db.session.add(section)
+        db.session.commit()
+        return section
+
+    return make
+
+
+@pytest.fixture
+def make_book(app, make_section):
+    def make(section: SectionModel = None, authors=("Test Author",)) -> BookModel:
+        section = section or make_section()
+        isbn = unique("isbn")
+        book = BookModel(
+            isbn=isbn,
+            name=f"Book {isbn}",
+            page_count=10,
+            content="books/test.pdf",
+            publisher="Test",
+            volume=1,
+            section_id=section.id,
+            search_word=isbn,
+            price=100,
+        )  # type: ignore
+        db.session.add(book)
+        db.session.flush()
+        for author_name in authors:
+            db.session.add(
+                BookAuthorModel(book_id=book.id, author_name=author_name, search_word=author_name)  # type: ignore
+            )
+        db.session.commit()
+        return book
+
+    return make
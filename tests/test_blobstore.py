@@ -0,0 +1,53 @@
+import io
+import os
+import uuid
+
+from blobstore import blob_path, claim_blob, collect_garbage, release_blob, store_stream
+from models import db, BlobClaimModel
+
+
+def stored_pdf() -> str:
+    return store_stream(io.BytesIO(b"%PDF-1.4 " + uuid.uuid4().bytes))
+
+
+def test_placed_blob_survives_garbage_collection_until_claimed(app, make_book):
+    content = stored_pdf()
+
+    # Placed but not yet referenced by a committed book
+    collect_garbage()
+    assert not release_blob(content)
+    assert os.path.exists(blob_path(content))
+
+    book = make_book()
+    with claim_blob(content):
+        book.content = content
+        db.session.commit()
+
+    assert not BlobClaimModel.query.filter_by(content=content).count()
+    collect_garbage()
+    assert os.path.exists(blob_path(content))
+
+
+def test_failed_claim_releases_the_blob(app):
+    content = stored_pdf()
+
+    try:
+        with claim_blob(content):
+            raise RuntimeError("insert failed")
+    except RuntimeError:
+        pass
+
+    assert not BlobClaimModel.query.filter_by(content=content).count()
+    assert not os.path.exists(blob_path(content))
+
+
+def test_release_keeps_a_blob_another_request_claimed(app):
+    content = stored_pdf()
+    store_stream(io.BytesIO(open(blob_path(content), "rb").read()))
+
+    # The first request gives up; the second still holds its claim
+    assert not release_blob(content, claimed=True)
+    assert os.path.exists(blob_path(content))
+
+    assert release_blob(content, claimed=True)
+    assert not os.path.exists(blob_path(content))
@@ -0,0 +1,16 @@
+import pytest
+
+from conftest import in_thread
+
+
+@pytest.fixture
+def librarian(make_user, login):
+    return login(make_user("Librarian"))
+
+
+@pytest.mark.parametrize("url", ["/readBook/?id={}", "/readBook/content/?id={}", "/download?id={}"])
+def test_missing_pdf_is_not_found(app, librarian, make_book, url):
+    book = make_book()
+
+    response = in_thread(librarian.get, url.format(book.id))
+    assert response.status_code == 404
@@ -0,0 +1,52 @@
+import io
+import sqlite3
+import uuid
+from concurrent.futures import Future
+
+from blobstore import store_stream
+from book_import import finish_batch
+from conftest import unique
+from models import BookModel
+
+
+def manifest_book(section_id: int) -> dict:
+    isbn = unique("isbn")
+    return {
+        "isbn": isbn,
+        "name": f"Book {isbn}",
+        "page_count": 10,
+        "publisher": "Test",
+        "volume": 1,
+        "section_id": section_id,
+        "price": 100,
+        "search_word": isbn,
+        "authors": ["Test Author"],
+        "path": "unused.pdf",
+    }
+
+
+def finished(result=None, error=None) -> Future:
+    future = Future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+    return future
+
+
+def test_a_failed_store_is_reported_and_the_rest_imported(app, make_section):
+    section = make_section()
+    stored, locked = manifest_book(section.id), manifest_book(section.id)
+    content = store_stream(io.BytesIO(b"%PDF-1.4 " + uuid.uuid4().bytes))
+
+    errors = []
+    imported = finish_batch(
+        [stored, locked],
+        [finished(content), finished(error=sqlite3.OperationalError("database is locked"))],
+        errors,
+    )
+
+    assert imported == 1
+    assert errors == [f"Book {locked['isbn']}: database is locked"]
+    assert BookModel.query.filter_by(isbn=stored["isbn"]).one().content == content
+    assert not BookModel.query.filter_by(isbn=locked["isbn"]).first()
@@ -0,0 +1,5 @@
+import threading
+
+
+def test_importing_the_app_starts_no_sweeper(app):
+    assert "issue-sweeper" not in {thread.name for thread in threading.enumerate()}
@@ -0,0 +1,75 @@
+import json
+import threading
+
+import pytest
+
+from book_feedback import save_feedback
+from conftest import in_thread
+from models import db, BookFeedbackModel, BookRatingModel, UserLoginModel
+
+parallel_posts = 8
+
+
+@pytest.fixture
+def librarian(make_user, login):
+    return login(make_user("Librarian"))
+
+
+def test_every_feedback_carries_its_own_book(app, librarian, make_user, make_book):
+    uid = UserLoginModel.query.filter_by(username=make_user()).one().id
+    books = [make_book(), make_book()]
+    for book in books:
+        save_feedback(uid, book.id, f"About {book.isbn}", 7)
+
+    expected = {(book.id, book.isbn) for book in books}
+
+    listed = in_thread(librarian.get, "/api/viewFeedbacks").get_json()
+    assert expected <= {(row["book_id"], row["isbn"]) for row in listed if row["username"] == uid}
+
+    # The body of a streamed response is produced in the request's context
+    body = in_thread(lambda: librarian.get("/api/viewFeedbacks?stream=1").get_data(as_text=True))
+    streamed = [json.loads(line) for line in body.splitlines()]
+    assert expected <= {(row["book_id"], row["isbn"]) for row in streamed if row["username"] == uid}
+
+    one = in_thread(librarian.get, f"/api/viewFeedbacks?isbn={books[0].isbn}").get_json()
+    assert [(row["book_id"], row["isbn"]) for row in one] == [(books[0].id, books[0].isbn)]
+
+
+def test_parallel_feedback_upserts_leave_one_row_each(app, make_user, login, make_book):
+    book = make_book()
+    usernames = [make_user(), make_user()]
+    clients = [login(username) for username in usernames for _ in range(parallel_posts)]
+    ratings = list(range(len(clients)))
+    barrier = threading.Barrier(len(clients))
+    statuses = []
+
+    def post(client, rating):
+        with app.app_context():
+            barrier.wait()
+            response = client.post(
+                "/api/bookFeedback",
+                json={"isbn": book.isbn, "feedback": f"Rated {rating}", "rating": rating % 11},
+            )
+            statuses.append((response.status_code, response.get_json()))
+
+    threads = [
+        threading.Thread(target=post, args=(client, rating))
+        for client, rating in zip(clients, ratings)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(status == 200 for status, _ in statuses), statuses
+
+    db.session.expire_all()
+    feedbacks = BookFeedbackModel.query.filter_by(book_id=book.id).all()
+    assert sorted(feedback.uid for feedback in feedbacks) == sorted(
+        UserLoginModel.query.filter_by(username=username).one().id for username in usernames
+    )
+
+    rating = db.session.get(BookRatingModel, book.id)
+    assert rating.rating_count == len(feedbacks)
+    assert rating.rating_sum == sum(feedback.rating for feedback in feedbacks)
+    for feedback in feedbacks:
+        assert getattr(rating, f"rating_{feedback.rating}") >= 1
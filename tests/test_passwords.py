@@ -0,0 +1,45 @@
+import threading
+
+import pytest
+
+import passwords
+from conftest import in_thread, test_password
+from passwords import LoginBusy, run_kdf
+
+
+@pytest.fixture
+def hash_timeout(app):
+    app.config["PASSWORD_HASH_TIMEOUT"] = 0.2
+    yield
+    app.config["PASSWORD_HASH_TIMEOUT"] = 5
+
+
+def test_slow_hash_gives_up_with_login_busy(app, hash_timeout):
+    release = threading.Event()
+    try:
+        with pytest.raises(LoginBusy):
+            run_kdf(release.wait, 10)
+    finally:
+        release.set()
+
+
+def test_login_answers_503_when_the_hash_times_out(app, hash_timeout, make_user, monkeypatch):
+    username = make_user()
+    release = threading.Event()
+
+    def stuck(stored, password):
+        release.wait(10)
+        return True
+
+    monkeypatch.setattr(passwords, "check_stored_password", stuck)
+    try:
+        response = in_thread(
+            app.test_client().post,
+            "/api/login",
+            json={"username": username, "password": test_password},
+        )
+    finally:
+        release.set()
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
@@ -0,0 +1,33 @@
+import pytest
+
+import previews
+from blobstore import content_version
+from conftest import in_thread
+
+
+@pytest.fixture
+def reader(make_user, login):
+    return login(make_user())
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    # Pretend a renderer is installed; a missing PDF must not reach it
+    monkeypatch.setattr(previews, "pdftoppm", "/bin/false")
+
+
+def test_book_with_missing_pdf_has_no_preview(app, reader, renderer, make_book):
+    book = make_book()
+
+    response = in_thread(reader.get, f"/viewBooks/{book.section_id}/search/?search_word=")
+    assert response.status_code == 200
+    assert book.name.encode() in response.data
+    assert b"/bookPreview/" not in response.data
+
+    response = in_thread(reader.get, f"/bookPreview/{book.id}?v={content_version(book.content)}")
+    assert response.status_code == 404
+
+
+def test_legacy_content_version_needs_no_file(app):
+    assert content_version("books/missing.pdf") == content_version("books/missing.pdf")
+    assert content_version("books/missing.pdf") != content_version("books/other.pdf")
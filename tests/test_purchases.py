@@ -0,0 +1,31 @@
+from datetime import date
+
+from conftest import in_thread
+from models import db, DailyBookRevenueModel, UserLoginModel
+from purchases import rebuild_purchase_summaries, record_purchase
+
+
+def revenue_today(book_id) -> int:
+    db.session.expire_all()
+    return db.session.get(DailyBookRevenueModel, (date.today(), book_id)).revenue
+
+
+def test_purchase_keeps_the_price_paid(app, make_user, login, make_book):
+    username = make_user()
+    uid = UserLoginModel.query.filter_by(username=username).one().id
+    book = make_book()
+
+    assert record_purchase(uid, book.id, book.price)
+    assert not record_purchase(uid, book.id, book.price)
+    assert revenue_today(book.id) == 100
+
+    # A later price change alters neither the purchase nor the summaries
+    book.price = 250
+    db.session.commit()
+    rebuild_purchase_summaries()
+    assert revenue_today(book.id) == 100
+
+    librarian = login(make_user("Librarian"))
+    purchases = in_thread(librarian.get, f"/api/purchases?isbn={book.isbn}").get_json()
+    assert [(purchase["uid"], purchase["price"]) for purchase in purchases] == [(uid, 100)]
+    assert isinstance(purchases[0]["id"], int)
@@ -0,0 +1,93 @@
+import re
+from datetime import date
+
+import pytest
+from sqlalchemy import delete, event, text
+from sqlalchemy.dialects import sqlite
+
+from conftest import in_thread
+from expiry import issue_not_expired
+from models import (
+    db,
+    BookFeedbackModel,
+    BookIssueModel,
+    BookModel,
+    BookRequestsModel,
+)
+
+
+def query_plan(statement) -> str:
+    """SQLite's EXPLAIN QUERY PLAN for a statement, one step per line."""
+    compiled = statement.compile(dialect=sqlite.dialect(paramstyle="named"))
+    params = {
+        name: value.isoformat() if isinstance(value, date) else value
+        for name, value in compiled.params.items()
+    }
+    rows = db.session.execute(text("EXPLAIN QUERY PLAN " + str(compiled)), params).all()
+    return "\n".join(row[-1] for row in rows)
+
+
+# The queries behind the hot routes, and the index each one has to use
+hot_queries = {
+    "requests of a user": (
+        lambda: BookRequestsModel.query.filter_by(uid=1).statement,
+        "ix_book_request_uid",
+    ),
+    "current issues of a user": (
+        lambda: BookIssueModel.query.filter_by(uid=1).filter(issue_not_expired()).statement,
+        "ix_book_issue_uid_date_of_return (uid=? AND date_of_return>?)",
+    ),
+    "books of a section": (
+        lambda: BookModel.query.filter_by(section_id=1).statement,
+        "ix_book_section_id",
+    ),
+    "books sharing a stored PDF": (
+        lambda: BookModel.query.filter_by(content="0" * 64).statement,
+        "ix_book_content",
+    ),
+    "expired issue sweep": (
+        lambda: delete(BookIssueModel).where(BookIssueModel.date_of_return < date.today()),
+        "ix_book_issue_date_of_return",
+    ),
+    "feedback of a book": (
+        lambda: BookFeedbackModel.query.filter_by(book_id=1).statement,
+        "ix_book_feedback_book_id",
+    ),
+}
+
+
+@pytest.mark.parametrize("name", hot_queries)
+def test_hot_query_uses_its_index(app, name):
+    statement, index = hot_queries[name]
+    plan = query_plan(statement())
+
+    assert re.search(r"SEARCH \w+ USING (COVERING )?INDEX " + re.escape(index), plan), plan
+    assert "SCAN" not in plan, plan
+
+
+@pytest.mark.parametrize("cursor", ["", "&after={}", "&before={}"])
+def test_rating_sort_reads_the_rank_index(app, make_user, login, make_book, cursor):
+    client = login(make_user())
+    book = make_book()
+
+    # Capture the statement /api/viewBooks?sort=rating really sends
+    sent = []
+
+    def capture(conn, dbapi_cursor, statement, parameters, context, executemany):
+        if "FROM book_rating" in statement:
+            sent.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", capture)
+    try:
+        response = in_thread(client.get, "/api/viewBooks?sort=rating" + cursor.format(book.id))
+    finally:
+        event.remove(db.engine, "before_cursor_execute", capture)
+    assert response.status_code in (200, 404), response.get_json()
+
+    statement, parameters = sent[-1]
+    rows = db.session.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+    plan = "\n".join(row[-1] for row in rows)
+
+    index_use = "SEARCH book_rating USING INDEX" if cursor else "SCAN book_rating USING INDEX"
+    assert index_use + " ix_book_rating_rank" in plan, plan
+    assert "TEMP B-TREE" not in plan, plan
@@ -0,0 +1,60 @@
+import pytest
+
+from conftest import in_thread
+from uploads import UploadError, finish_upload, locked_upload
+
+pdf = b"%PDF-1.4 " + b"x" * 100
+
+
+@pytest.fixture
+def librarian(make_user, login):
+    return login(make_user("Librarian"))
+
+
+def start(client, size: int) -> str:
+    response = in_thread(client.post, f"/api/uploads?size={size}")
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()["upload_id"]
+
+
+def send(client, upload_id: str, offset: int, data: bytes):
+    return in_thread(client.put, f"/api/uploads/{upload_id}?offset={offset}", data=data)
+
+
+def test_start_requires_a_size(librarian):
+    assert in_thread(librarian.post, "/api/uploads").status_code == 400
+    assert in_thread(librarian.post, "/api/uploads?size=0").status_code == 400
+
+
+def test_upload_may_not_grow_past_its_declared_size(librarian):
+    upload_id = start(librarian, len(pdf) - 1)
+
+    response = send(librarian, upload_id, 0, pdf)
+    assert response.status_code == 413
+
+    # The rejected chunk was cut off again
+    response = in_thread(librarian.get, f"/api/uploads/{upload_id}")
+    assert response.get_json()["offset"] == 0
+    assert response.get_json()["size"] == len(pdf) - 1
+
+
+def test_finish_rejects_an_incomplete_upload(app, librarian):
+    upload_id = start(librarian, len(pdf))
+    assert send(librarian, upload_id, 0, pdf[:50]).status_code == 200
+
+    with pytest.raises(UploadError) as error:
+        finish_upload(upload_id)
+    assert error.value.status == 409
+
+    assert send(librarian, upload_id, 50, pdf[50:]).status_code == 200
+    assert len(finish_upload(upload_id)) == 64
+
+
+def test_chunk_is_refused_while_another_request_holds_the_upload(app, librarian):
+    upload_id = start(librarian, len(pdf))
+
+    with locked_upload(upload_id):
+        response = send(librarian, upload_id, 0, pdf)
+    assert response.status_code == 409
+
+    assert send(librarian, upload_id, 0, pdf).get_json()["offset"] == len(pdf)
@@ -0,0 +1,85 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from book_feedback import save_feedback
+from conftest import in_thread
+from models import db, UserLoginModel
+
+
+@contextmanager
+def count_statements():
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+
+
+def view_books(client):
+    with count_statements() as statements:
+        response = in_thread(client.get, "/api/viewBooks?limit=100")
+    assert response.status_code == 200, response.get_json()
+    return response.get_json(), len(statements)
+
+
+def test_view_books_statement_count_does_not_grow_with_books(make_user, login, make_book, make_section):
+    client = login(make_user("Librarian"))
+    section = make_section()
+    make_book(section)
+
+    books, statements = view_books(client)
+
+    for number in range(12):
+        make_book(section, authors=[f"Author {number}", f"Second author {number}"])
+    more_books, more_statements = view_books(client)
+
+    assert len(more_books) == len(books) + 12
+    assert more_statements == statements
+
+
+def test_view_books_lists_authors_and_section(make_user, login, make_book, make_section):
+    client = login(make_user("Librarian"))
+    section = make_section()
+    book = make_book(section, authors=["First", "Second"])
+
+    books, _ = view_books(client)
+
+    listed = next(row for row in books if row["id"] == book.id)
+    assert listed["section_name"] == section.name
+    assert sorted(listed["authors"].split(",")) == ["First", "Second"]
+
+
+def test_rating_sort_pages_best_rated_first(make_user, login, make_book, make_section):
+    client = login(make_user())
+    uid = UserLoginModel.query.filter_by(username=make_user()).one().id
+    section = make_section()
+    books = [make_book(section) for _ in range(5)]
+    for book, rating in zip(books, [3, 9, None, 9, 0]):
+        if rating is not None:
+            save_feedback(uid, book.id, "Rated", rating)
+
+    def page(query):
+        response = in_thread(client.get, "/api/viewBooks?sort=rating&limit=2" + query)
+        assert response.status_code == 200, response.get_json()
+        return [book["id"] for book in response.get_json()], 'rel="next"' in response.headers.get("Link", "")
+
+    # Every book of the catalogue, best first; ties go to the newest book
+    listed = []
+    query = ""
+    while True:
+        ids, has_next = page(query)
+        listed += ids
+        if not has_next:
+            break
+        query = f"&after={ids[-1]}"
+    ours = [book_id for book_id in listed if book_id in {book.id for book in books}]
+    assert ours == [books[3].id, books[1].id, books[0].id, books[4].id, books[2].id]
+
+    position = listed.index(books[0].id)
+    assert page(f"&before={books[0].id}")[0] == listed[max(0, position - 2) : position]
@@ -0,0 +1,205 @@
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from flask import current_app
+from typing import BinaryIO, Iterator
+from blobstore import blob_root, chunk_size, file_digest, place_blob
+
+# Without fcntl (Windows) uploads are not locked against concurrent chunks
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# A resumable upload is a <upload_id>.part file in the blob directory, so the
+# finished file can be renamed into the store without copying, plus a
+# <upload_id>.size file holding the size the client declared when starting
+# it. The client sends chunks in order and asks for the current offset to
+# resume. Each request holds an exclusive lock on the .part file while it
+# works on the upload.
+pdf_magic = b"%PDF-"
+
+upload_id_pattern = re.compile(r"[0-9a-f]{32}")
+
+
+class UploadError(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def upload_path(upload_id: str) -> str:
+    if not upload_id or not upload_id_pattern.fullmatch(upload_id):
+        raise UploadError("Invalid upload id")
+
+    path = os.path.join(blob_root(), upload_id + ".part")
+    if not os.path.exists(path):
+        raise UploadError("Upload not found", 404)
+    return path
+
+
+def size_path(part_path: str) -> str:
+    return part_path[: -len(".part")] + ".size"
+
+
+def declared_size(path: str) -> int:
+    try:
+        with open(size_path(path)) as size_file:
+            return int(size_file.read())
+    except (OSError, ValueError):
+        raise UploadError("Upload has no declared size", 409)
+
+
+@contextmanager
+def locked_upload(upload_id: str) -> Iterator[BinaryIO]:
+    """Open an upload's .part file, holding its lock, or fail with 409 if another request has it."""
+    path = upload_path(upload_id)
+    try:
+        part = open(path, "r+b")
+    except FileNotFoundError:
+        raise UploadError("Upload not found", 404)
+
+    with part:
+        if fcntl is not None:
+            try:
+                fcntl.flock(part.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError("Another request is writing to this upload", 409)
+
+        # Finished or cancelled while this request waited to open it
+        if not os.path.exists(path):
+            raise UploadError("Upload not found", 404)
+        yield part
+
+
+def start_upload(size: int) -> str:
+    """Create an empty upload of size bytes and return its id."""
+    max_size = current_app.config["MAX_BOOK_SIZE"]
+    if size < 1:
+        raise UploadError("Upload size must be a positive integer")
+    if size > max_size:
+        raise UploadError(f"Book PDFs can be at most {max_size} bytes", 413)
+
+    os.makedirs(blob_root(), exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    path = os.path.join(blob_root(), upload_id + ".part")
+    with open(size_path(path), "x") as size_file:
+        size_file.write(str(size))
+    open(path, "xb").close()
+    return upload_id
+
+
+def upload_offset(upload_id: str) -> int:
+    """Bytes received so far, which is where the next chunk has to start."""
+    return os.path.getsize(upload_path(upload_id))
+
+
+def upload_size(upload_id: str) -> int:
+    return declared_size(upload_path(upload_id))
+
+
+def read_exactly(stream: BinaryIO, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def append_chunk(upload_id: str, offset: int, stream: BinaryIO) -> int:
+    """Stream one chunk onto the end of an upload and return the new offset.
+
+    offset must equal the bytes already received. The first chunk has to
+    start with a PDF header, and the upload may not grow past its declared
+    size. A chunk that fails part way is cut off again, so the client can
+    resend it.
+    """
+    with locked_upload(upload_id) as part:
+        received = os.fstat(part.fileno()).st_size
+        if offset != received:
+            raise UploadError(f"Chunk should start at offset {received}", 409)
+
+        size = declared_size(part.name)
+        part.seek(offset)
+        try:
+            if offset == 0:
+                header = read_exactly(stream, len(pdf_magic))
+                if header != pdf_magic:
+                    raise UploadError("This file is not a PDF", 415)
+                part.write(header)
+
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                if part.tell() + len(chunk) > size:
+                    raise UploadError(
+                        f"Upload is larger than its declared {size} bytes", 413
+                    )
+                part.write(chunk)
+
+            return part.tell()
+
+        except BaseException:
+            part.truncate(offset)
+            raise
+
+
+def remove_upload(path: str):
+    os.remove(path)
+    if os.path.exists(size_path(path)):
+        os.remove(size_path(path))
+
+
+def cancel_upload(upload_id: str):
+    with locked_upload(upload_id) as part:
+        remove_upload(part.name)
+
+
+def finish_upload(upload_id: str) -> str:
+    """Move a complete upload into the blob store and return its digest.
+
+    The upload must have exactly its declared size. The digest is computed
+    from the file on disk, since the chunks may have arrived over several
+    requests. Use the result inside claim_blob.
+    """
+    with locked_upload(upload_id) as part:
+        received = os.fstat(part.fileno()).st_size
+        size = declared_size(part.name)
+        if received != size:
+            raise UploadError(f"Upload has {received} of its declared {size} bytes", 409)
+
+        content = file_digest(part.name)
+        place_blob(part.name, content)
+        os.remove(size_path(part.name))
+    return content
+
+
+def remove_stale_uploads() -> int:
+    """Delete uploads untouched for UPLOAD_EXPIRY seconds."""
+    root = blob_root()
+    if not os.path.isdir(root):
+        return 0
+
+    cutoff = time.time() - current_app.config["UPLOAD_EXPIRY"]
+    removed = 0
+    for entry in os.scandir(root):
+        if (
+            entry.is_file()
+            and entry.name.endswith(".part")
+            and entry.stat().st_mtime < cutoff
+        ):
+            remove_upload(entry.path)
+            removed += 1
+        elif (
+            entry.is_file()
+            and entry.name.endswith(".size")
+            and not os.path.exists(entry.path[: -len(".size")] + ".part")
+            and entry.stat().st_mtime < cutoff
+        ):
+            os.remove(entry.path)
+    return removed